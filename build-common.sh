@@ -49,6 +49,22 @@ if [ "$OPTIONS" != "--pool" ]; then
 	cd ..
 	# delete empty folders
 	find . -type d -empty -print -delete
+	echo -e "\t###\tGENERATING MANIFEST\t###\t"
+	# This lets the installer check the kernel version without decompressing the archive
+	image=$(find kernel -name 'linux-image-*.deb' -not -path 'kernel/linux-meta/*' | head -1)
+	release=$(dpkg-deb --field "$image" Package | sed 's/^linux-image-//')
+	packages="[]"
+	for each in $(find kernel -name '*.deb' | sort); do
+		packages=$(echo "$packages" | jq \
+			--arg file "${each##*/}" \
+			--arg package "$(dpkg-deb --field "$each" Package)" \
+			--arg version "$(dpkg-deb --field "$each" Version)" \
+			--arg sha256 "$(sha256sum "$each" | awk '{print $1}')" \
+			'. + [{file: $file, package: $package, version: $version, sha256: $sha256}]')
+	done
+	jq -n --arg version "$release" --argjson packages "$packages" \
+		'{version: $version, packages: $packages}' > kernel/manifest.json
+	cp -v kernel/manifest.json kernel.json
 	echo -e "\t###\tCOMPRESSING\t###\t"
 	tar --verbose --create --xz -f kernel.tar.xz kernel
 	echo -e "\t###\tCLEANING\t###\t"
@@ -56,6 +72,48 @@ if [ "$OPTIONS" != "--pool" ]; then
 	cd ../../..
 fi
 
+# Build an index of which NVIDIA driver branches support which GPUs, so the
+# installer doesn't have to download every driver to find out
+# This downloads every driver branch, so skip it with --pool too. The
+# installer probes drivers itself when there is no index, so if this fails
+# we just go on without it.
+if [ "$OPTIONS" != "--pool" ]; then
+	echo -e "\t###\tGENERATING NVIDIA INDEX\t###\t"
+	rm -rf nvidia-index
+	if (
+		mkdir nvidia-index && cd nvidia-index || exit 1
+		echo '{}' > devices.json
+		drivers=()
+		for each in $(apt-cache search --names-only '^nvidia-driver-[0-9]+$' | awk '{print $1}' | sed 's/nvidia-driver-//' | sort -nr); do
+			apt-get download "nvidia-driver-$each" || continue
+			dpkg --extract nvidia-driver-"$each"_*.deb "$each" || continue
+			json="$each/usr/share/doc/nvidia-driver-$each/supported-gpus.json"
+			# Older drivers only have a README. The installer probes those itself.
+			if [ ! -f "$json" ]; then
+				continue
+			fi
+			jq --argjson driver "$each" --slurpfile gpus "$json" \
+				'reduce ($gpus[0].chips[] | select(has("legacybranch") | not) | .devid[2:] | ascii_downcase) as $id
+					(.; .[$id] = ((.[$id] // []) + [$driver] | unique | reverse))' \
+				devices.json > devices.json.new || continue
+			mv devices.json.new devices.json
+			drivers+=("$each")
+		done
+		if [ ${#drivers[@]} -eq 0 ]; then
+			exit 1
+		fi
+		jq -n --argjson drivers "$(printf '%s\n' "${drivers[@]}" | jq -s '.')" \
+			--slurpfile devices devices.json \
+			'{version: 1, drivers: $drivers, devices: $devices[0]}' > ../etc/edamame/nvidia.json.new
+	); then
+		mv -v etc/edamame/nvidia.json.new etc/edamame/nvidia.json
+	else
+		echo "Could not build NVIDIA index. Skipping..." 1>&2
+		rm -fv etc/edamame/nvidia.json.new
+	fi
+	rm -rf nvidia-index
+fi
+
 # Pshyc - we're compiling shit now
 cd usr/bin
 echo "Would you like to build with Python 3.11, or 3.12?"
@@ -91,6 +91,13 @@ class Main(Gtk.Window):
             else:
                 label = label + """
 <b>HOME:</b>      %s""" % (settings["HOME"])
+            plan = ap.preview(settings["ROOT"], settings["EFI"],
+                              settings["HOME"], settings["raid_array"])
+            if len(plan) > 0:
+                label = label + """
+
+<b>PLANNED PARTITIONS:</b>
+""" + "\n".join(plan)
         else:
             label = """<b>ROOT:</b>       %s
 
@@ -37,6 +37,7 @@ from gi.repository import Gtk
 
 import common
 import auto_partitioner as ap
+import block_devices
 
 
 def has_special_character(input_string):
@@ -629,9 +630,7 @@ class Main(Gtk.Window):
         self.data["AUTO_PART"] = True
 
         # Get a list of disks and their capacity
-        self.devices = json.loads(subprocess.check_output(["lsblk", "-n", "-i", "--json",
-                                                           "-o", "NAME,SIZE,TYPE,FSTYPE"]).decode())
-        self.devices = self.devices["blockdevices"]
+        self.devices = block_devices.get_display_tree()
         dev = []
         for each2 in enumerate(self.devices):
             if "loop" in self.devices[each2[0]]["name"]:
@@ -26,8 +26,9 @@ import signal
 import json
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, GLib
-from os import remove
+from gi.repository import Gtk, GLib, Gio
+import progress_channel
+import log_tail
 
 window = None
 
@@ -73,7 +74,21 @@ to: contact@draugeros.org   """ % (self.distro))
 
         self.set_position(Gtk.WindowPosition.CENTER)
 
-        self.source_id = GLib.timeout_add(33, self.pulse)
+        self.stage = ""
+        self.percent = 0
+        self.channel = progress_channel.subscribe()
+        if self.channel is not None:
+            self.channel_id = GLib.io_add_watch(self.channel.fileno(),
+                                                GLib.PRIORITY_DEFAULT,
+                                                GLib.IO_IN, self.pulse)
+        # Redraw the log only when it changes. The timer is a fallback in
+        # case file monitoring isn't available.
+        self.log = log_tail.LogTail("/tmp/edamame.log", lines=10)
+        self.monitor = Gio.File.new_for_path(self.log.path).monitor_file(
+            Gio.FileMonitorFlags.NONE, None)
+        self.monitor.connect("changed", self.on_log_changed)
+        self.source_id = GLib.timeout_add(1000, self.read_file)
+        self.read_file()
 
     def _set_default_margins(self, widget):
         """Set default margin size"""
@@ -83,53 +98,44 @@ to: contact@draugeros.org   """ % (self.distro))
         widget.set_margin_bottom(10)
         return widget
 
+    def on_log_changed(self, monitor, file, other_file, event_type):
+        """Update log output when the log file changes"""
+        self.read_file()
+
     def read_file(self):
-        """Read Progress log"""
-        text = ""
-        try:
-            with open("/tmp/edamame.log", "r") as read_file:
-                text = read_file.read()
-            if len(text.split("\n")) > 10:
-                text = text.split("\n")
-                text = text[-10:]
-                for each in enumerate(text):
-                    if len(text[each[0]]) > 90:
-                        text[each[0]] = text[each[0]][:90]
-                    elif len(text[each[0]]) < 90:
-                        multiplyer = 90 - len(text[each[0]])
-                        text[each[0]] = text[each[0]] + (" " * multiplyer)
-                text = "\n".join(text)
-            self.file_contents.set_text(text, len(text))
-        except FileNotFoundError:
-            self.file_contents.set_text("", len(""))
-
-        self.show_all()
+        """Read new lines from the log and redraw if there are any"""
+        if not self.log.read():
+            return True
+        text = self.log.get_lines()
+        for each in enumerate(text):
+            # keep every line at 90 columns so the window doesn't resize
+            text[each[0]] = each[1][:90].ljust(90)
+        text = "\n".join(text)
+        self.file_contents.set_text(text, len(text))
         return True
 
 
-    def pulse(self):
-        """Update progress indicator and log output in GUI"""
-        fraction = ""
-        try:
-            with open("/tmp/edamame-progress.log", "r") as prog_file:
-                fraction = prog_file.read()
-        except FileNotFoundError:
-            fraction = 0
-        try:
-            fraction = int(fraction) / 100
-            self.progress.set_fraction(fraction)
-        except ValueError:
-            self.progress.set_fraction(0)
-        if fraction == 1:
-            remove("/tmp/edamame-progress.log")
-            remove("/mnt/tmp/edamame-progress.log")
-            Gtk.main_quit("delete-event")
-            self.destroy()
-            self.source_id = None
-            return False
-
-        self.show_all()
-        self.read_file()
+    def pulse(self, fd, condition):
+        """Update progress indicator from messages sent by the installer"""
+        for each in progress_channel.receive(self.channel):
+            if each["type"] == "percent":
+                self.percent = min(max(each["value"], 0), 100)
+                self.progress.set_fraction(self.percent / 100)
+                if self.stage:
+                    self.progress.set_text(f"{self.stage} - {self.percent}%")
+                if each["value"] >= 100:
+                    GLib.source_remove(self.source_id)
+                    self.source_id = None
+                    self.monitor.cancel()
+                    self.channel.close()
+                    Gtk.main_quit("delete-event")
+                    self.destroy()
+                    return False
+            elif each["type"] == "stage":
+                self.stage = each["value"]
+                self.progress.set_text(f"{self.stage} - {self.percent}%")
+            elif each["type"] == "error":
+                self.progress.set_text(f"Error: {each['value']}")
         return True
 
 
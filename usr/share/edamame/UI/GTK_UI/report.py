@@ -31,6 +31,7 @@ import json
 import gnupg
 import gi
 import urllib3
+import hardware
 
 # Configuration required to use some of these libs
 gi.require_version('Gtk', '3.0')
@@ -439,7 +440,7 @@ If you would like a response, please leave:
         else:
             output['CPU INFO'] = 'OPT OUT'
         if self.gpu.get_active():
-            output['PCIe / GPU INFO'] = get_info(["lspci", "-nnq"])
+            output['PCIe / GPU INFO'] = hardware.get_report()
         else:
             output['PCIe / GPU INFO'] = 'OPT OUT'
         if self.ram.get_active():
@@ -90,6 +90,14 @@ class Main(QtWidgets.QWidget):
             else:
                 label = label + f"""
 **HOME:**      {settings["HOME"]}"""
+            plan = ap.preview(settings["ROOT"], settings["EFI"],
+                              settings["HOME"], settings["raid_array"])
+            if len(plan) > 0:
+                label = label + """
+
+**PLANNED PARTITIONS:**
+
+""" + "\n\n".join(plan)
         else:
             label = f"""**ROOT:**       {settings["ROOT"]}
 
@@ -32,6 +32,7 @@ import random
 from qtpy import QtGui, QtWidgets, QtCore
 import common
 import auto_partitioner as ap
+import block_devices
 try:
     import UI.QT_UI.qt_common as QCommon
 except ImportError:
@@ -600,9 +601,7 @@ now.\n
         self.data["AUTO_PART"] = True
 
         # Get a list of disks and their capacity
-        self.devices = json.loads(subprocess.check_output(["lsblk", "-n", "-i", "--json",
-                                                           "-o", "NAME,SIZE,TYPE,FSTYPE"]).decode())
-        self.devices = self.devices["blockdevices"]
+        self.devices = block_devices.get_display_tree()
         dev = []
         for each2 in enumerate(self.devices):
             if "loop" in self.devices[each2[0]]["name"]:
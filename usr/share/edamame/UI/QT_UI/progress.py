@@ -25,12 +25,13 @@
 import sys
 import signal
 import json
-from os import remove
 from qtpy import QtCore, QtWidgets, QtGui
 try:
     import UI.QT_UI.qt_common as QCommon
 except ImportError:
     import qt_common as QCommon
+import progress_channel
+import log_tail
 
 window = None
 
@@ -77,8 +78,19 @@ the log file (located at /tmp/edamame.log) to: contact@draugeros.org""")
 
         # self.set_position(Gtk.WindowPosition.CENTER)
 
-        self.signal.connect(self.pulse)
-        self.startTimer(33)
+        self.channel = progress_channel.subscribe()
+        if self.channel is not None:
+            self.notifier = QtCore.QSocketNotifier(self.channel.fileno(),
+                                                   QtCore.QSocketNotifier.Read)
+            self.notifier.activated.connect(self.pulse)
+        # Redraw the log only when it changes. The timer is a fallback in
+        # case file monitoring isn't available.
+        self.log = log_tail.LogTail("/tmp/edamame.log", lines=8)
+        self.watcher = QtCore.QFileSystemWatcher([self.log.path])
+        self.watcher.fileChanged.connect(self.on_log_changed)
+        self.signal.connect(self.read_file)
+        self.startTimer(1000)
+        self.read_file()
 
     # def _set_default_margins(self, widget):
     #     """Set default margin size"""
@@ -88,45 +100,36 @@ the log file (located at /tmp/edamame.log) to: contact@draugeros.org""")
     #     widget.set_margin_bottom(10)
     #     return widget
 
+    def on_log_changed(self, path):
+        """Update log output when the log file changes"""
+        # The watch is dropped if the file is replaced, so add it back
+        if path not in self.watcher.files():
+            self.watcher.addPath(path)
+        self.read_file()
+
     def read_file(self):
-        """Read Progress log"""
-        text = ""
-        try:
-            with open("/tmp/edamame.log", "r") as read_file:
-                text = read_file.read()
-            if len(text.split("\n")) > 9:
-                text = text.split("\n")
-                text = text[-8:]
-                for each in enumerate(text):
-                    if len(each[1]) > 80:
-                        text[each[0]] = each[1][:80]
-                text = "\n".join(text)
-            self.file_contents.setText(text)
-        except FileNotFoundError:
-            self.file_contents.setText("")
+        """Read new lines from the log and redraw if there are any"""
+        if not self.log.read():
+            return True
+        text = [each[:80] for each in self.log.get_lines()]
+        self.file_contents.setText("\n".join(text))
         return True
 
 
-    def pulse(self):
-        """Update progress indicator and log output in GUI"""
-        fraction = ""
-        try:
-            with open("/tmp/edamame-progress.log", "r") as prog_file:
-                fraction = int(prog_file.read())
-        except FileNotFoundError:
-            fraction = 0
-        try:
-            self.progress.setValue(fraction)
-        except ValueError:
-            self.progress.setValue(0)
-        if fraction == 100:
-            remove("/tmp/edamame-progress.log")
-            remove("/mnt/tmp/edamame-progress.log")
-            self.close()
-            self.source_id = None
-            return False
-
-        self.read_file()
+    def pulse(self, *args):
+        """Update progress indicator from messages sent by the installer"""
+        for each in progress_channel.receive(self.channel):
+            if each["type"] == "percent":
+                self.progress.setValue(min(max(each["value"], 0), 100))
+                if each["value"] >= 100:
+                    self.notifier.setEnabled(False)
+                    self.channel.close()
+                    self.close()
+                    return False
+            elif each["type"] == "stage":
+                self.progress.setFormat(f"{each['value']} - %p%")
+            elif each["type"] == "error":
+                self.progress.setFormat(f"Error: {each['value']}")
         return True
 
     def timerEvent(self, *args, **kwargs):
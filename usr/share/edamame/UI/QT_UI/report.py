@@ -30,6 +30,7 @@ import json
 import gnupg
 from qtpy import QtGui, QtWidgets, QtCore
 import urllib3
+import hardware
 import common
 
 try:
@@ -399,7 +400,7 @@ If you would like a response, please leave:
         else:
             output['CPU INFO'] = 'OPT OUT'
         if self.gpu.isChecked():
-            output['PCIe / GPU INFO'] = get_info(["lspci", "-nnq"])
+            output['PCIe / GPU INFO'] = hardware.get_report()
         else:
             output['PCIe / GPU INFO'] = 'OPT OUT'
         if self.ram.isChecked():
@@ -23,13 +23,17 @@
 #
 """Auto-partition Drive selected for installation"""
 import json
-import time
 import os
+import functools
+import concurrent.futures as futures
+import fcntl
+import struct
 import sys
 import subprocess
 import parted
 import psutil
 import common
+import block_devices
 
 
 def gb_to_bytes(gb):
@@ -60,6 +64,8 @@ def part_to_drive(part):
 
 # GET DEFAULT CONFIG
 LIMITER = gb_to_bytes(32)
+# ioctl to discard a range of bytes on a block device, from linux/fs.h
+BLKDISCARD = 0x1277
 PARTITIONING_ENABLED = True
 
 # get configuration for partitioning
@@ -251,108 +257,104 @@ def get_min_efi_size():
 
 
 def check_disk_state():
-    """Check disk state as registered with lsblk
+    """Get the current state of all block devices, except loop devices
 
-    Returns data as dictionary
+    Returns data as a list of dictionaries, laid out the same as
+    `lsblk --json --paths --bytes'. Partitions are listed under
+    `children' on their disk.
     """
-    try:
-        subprocess.check_call(["partprobe"])
-    except subprocess.CalledProcessError:
-        print("`partprobe` failed. Provided info may not be up-to-date.")
-    time.sleep(0.2)
-    command = ["lsblk", "--json", "--paths", "--bytes", "--output",
-               "name,size,type,fstype"]
-    data = json.loads(subprocess.check_output(command))["blockdevices"]
-    for each in range(len(data) - 1, -1, -1):
-        if data[each]["type"] == "loop":
-            del data[each]
-    return data
+    return block_devices.get_tree()
 
 
 def get_fs(part_name: str):
     """Get filesystem type for given partition"""
-    disk = check_disk_state()
-    for each in disk:
-        if each["name"] == part_name:
-            return each["fstype"]
-        if "children" in each:
-            for each1 in each["children"]:
-                if each1["name"] == part_name:
-                    return each1["fstype"]
-
-
-def __mkfs__(device, fs):
-    """Set partition filesystem"""
+    device = block_devices.get_device(part_name)
+    if device is None:
+        return None
+    return device["fstype"]
+
+
+def __mkfs_options__(device, fs, trimmed=False):
+    """Pick mkfs options for device, based on the drive it's on
+
+    If trimmed is True, device has just been discarded, so mkfs doesn't
+    need to do it again.
+    """
+    part = block_devices.get_device(device)
+    disk = None
+    if part is not None:
+        disk = block_devices.get_device(part.get("disk", device))
+    rotational = disk is None or disk.get("rotational", True)
+    options = []
+    if "ext" in fs:
+        extended = []
+        if rotational:
+            # Leave zeroing inode tables and the journal for after mounting,
+            # rather than writing the whole partition now
+            extended += ["lazy_itable_init=1", "lazy_journal_init=1"]
+        if trimmed:
+            extended.append("nodiscard")
+        if len(extended) > 0:
+            options += ["-E", ",".join(extended)]
+    elif fs == "btrfs":
+        if trimmed:
+            options.append("--nodiscard")
+    return options
+
+
+def __mkfs__(device, fs, trimmed=False):
+    """Set partition filesystem
+
+    Returns mkfs's output. Raises subprocess.CalledProcessError if it fails.
+    """
+    if fs in ("fat32", "vfat"):
+        return __mkfs_fat__(device)
     # pre-define command
     if "ext" in fs:
         force = "-F"
     else:
         force = "-f"
-    command = ["mkfs", "-t", fs, force, str(device)]
-    try:
-        try:
-            data = subprocess.check_output(command).decode()
-        except UnicodeDecodeError:
-            return ""
-    except subprocess.CalledProcessError as error:
-        data = error.output.decode()
-    return data
+    command = ["mkfs", "-t", fs, force] + __mkfs_options__(device, fs, trimmed)
+    command.append(str(device))
+    return subprocess.check_output(command,
+                                   stderr=subprocess.STDOUT).decode(errors="replace")
 
 
-if is_EFI():
-    def __mkfs_fat__(device):
-        """Set partition filesystem to FAT32"""
-        # pre-define command
-        command = ["mkfs.fat", "-F", "32", str(device)]
-        try:
-            data = subprocess.check_output(command).decode()
-        except subprocess.CalledProcessError as error:
-            data = error.output.decode()
-        return data
+def __mkfs_fat__(device):
+    """Set partition filesystem to FAT32
 
+    Returns mkfs's output. Raises subprocess.CalledProcessError if it fails.
+    """
+    # pre-define command
+    command = ["mkfs.fat", "-F", "32", str(device)]
+    return subprocess.check_output(command,
+                                   stderr=subprocess.STDOUT).decode(errors="replace")
 
-    def __make_efi__(device, start=config["EFI"]["START"],
-                     end=config["EFI"]["END"]):
-        """Make EFI partition"""
-        disk = parted.Disk(device)
-        start_geo = parted.geometry.Geometry(device=device,
-                                             start=parted.sizeToSectors(start,
-                                                                        "MB",
-                                                                        device.sectorSize),
-                                             end=parted.sizeToSectors(start + 10,
-                                                                      "MB",
-                                                                      device.sectorSize))
-        end_geo = parted.geometry.Geometry(device=device,
-                                           start=parted.sizeToSectors(common.real_number(end - 20),
-                                                                      "MB",
-                                                                      device.sectorSize),
-                                           end=parted.sizeToSectors(end + 10,
-                                                                    "MB",
-                                                                    device.sectorSize))
-        min_size = parted.sizeToSectors(common.real_number((end - start) - 25),
-                                        "MB",
-                                        device.sectorSize)
-        max_size = parted.sizeToSectors(common.real_number((end - start) + 20),
-                                        "MB",
-                                        device.sectorSize)
-        const = parted.Constraint(startAlign=device.optimumAlignment,
-                                  endAlign=device.optimumAlignment,
-                                  startRange=start_geo, endRange=end_geo,
-                                  minSize=min_size, maxSize=max_size)
-        geometry = parted.geometry.Geometry(start=start,
-                                            length=parted.sizeToSectors(end - start,
-                                                                        "MB",
-                                                                        device.sectorSize),
-                                            device=device)
-        new_part = parted.Partition(disk=disk,
-                                    type=parted.PARTITION_NORMAL,
-                                    geometry=geometry)
-        new_part.setFlag(parted.PARTITION_BOOT)
-        disk.addPartition(partition=new_part, constraint=const)
-        disk.commit()
-        time.sleep(0.1)
-        __mkfs_fat__(new_part.path)
-        return new_part.path
+
+def __run_jobs__(jobs):
+    """Run every job in jobs at once
+
+    jobs should be a dictionary of names (such as the partition being
+    formatted) to functions taking no arguments.
+
+    Returns a dictionary of the names of jobs that failed, to the error
+    they failed with. Jobs that succeeded are left out.
+    """
+    errors = {}
+    if len(jobs) == 0:
+        return errors
+    with futures.ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        running = {pool.submit(jobs[each]): each for each in jobs}
+        for each in futures.as_completed(running):
+            try:
+                each.result()
+            except (subprocess.CalledProcessError, OSError, ValueError) as error:
+                errors[running[each]] = error
+                common.eprint(f"{ running[each] } FAILED: { error }")
+                if isinstance(error, subprocess.CalledProcessError) and error.output:
+                    common.eprint(error.output.decode(errors="replace"))
+    block_devices.invalidate()
+    return errors
 
 
 def sectors_to_size(sectors, sector_size):
@@ -360,146 +362,118 @@ def sectors_to_size(sectors, sector_size):
     return (sectors * sector_size) / 1000 ** 2
 
 
-def __make_root__(device, start=config["ROOT"]["START"],
-                  end=config["ROOT"]["END"], fs=config["ROOT"]["fs"]):
-    """Make root partition"""
-    # __parted__(device, ["mkpart", name, fs, str(start), str(end)])
-    size = sectors_to_size(device.length, device.sectorSize)
-    try:
-        if start[-1] == "%":
-            start = int(start[:-1]) / 100
-            start = int(size * start)
-    except TypeError:
-        pass
-    try:
-        if end[-1] == "%":
-            end = int(end[:-1]) / 100
-            end = int(size * end)
-    except TypeError:
-        pass
-    disk = parted.Disk(device)
-    s_geo = parted.geometry.Geometry(device=device,
-                                     start=parted.sizeToSectors(common.real_number(start - 20),
-                                                                "MB",
-                                                                device.sectorSize),
-                                     end=parted.sizeToSectors(start + 20,
-                                                              "MB",
-                                                              device.sectorSize))
-    e_geo = parted.geometry.Geometry(device=device,
-                                     start=parted.sizeToSectors(common.real_number(end - 100),
-                                                                "MB",
-                                                                device.sectorSize),
-                                     end=parted.sizeToSectors(end, "MB",
-                                                              device.sectorSize))
-    min_size = parted.sizeToSectors(common.real_number((end - start) - 250),
-                                    "MB",
-                                    device.sectorSize)
-    max_size = parted.sizeToSectors(common.real_number((end - start) + 250),
-                                    "MB",
-                                    device.sectorSize)
-    const = parted.Constraint(startAlign=device.optimumAlignment,
-                              endAlign=device.optimumAlignment,
-                              startRange=s_geo, endRange=e_geo,
-                              minSize=min_size,
-                              maxSize=max_size)
-    geo = parted.geometry.Geometry(start=parted.sizeToSectors(start, "MB",
-                                                              device.sectorSize),
-                                   length=parted.sizeToSectors((end - start),
-                                                               "MB",
-                                                               device.sectorSize),
-                                   device=device)
-    new_part = parted.Partition(disk=disk,
-                                type=parted.PARTITION_NORMAL,
-                                geometry=geo)
-    try:
-        disk.addPartition(partition=new_part, constraint=const)
-    except parted._ped.PartitionException:
-        # Simply use the geometry of the first free space region, if it is big enough
-        data = disk.getFreeSpaceRegions()
-        sizes = {}
-        for each in data:
-            sizes[each.getSize(unit="b")] = each
-        sizes_sorted = sorted(sizes)
-        made = False
-        for each in range(len(sizes_sorted) - 1, -1, -1):
-            if sizes[sizes_sorted[each]].getSize(unit="b") >= get_min_root_size():
-                s_geo = parted.geometry.Geometry(device=device,
-                                                 start=parted.sizeToSectors(common.real_number(sizes[sizes_sorted[each]].start - 2000),
-                                                                            "MB",
-                                                                            device.sectorSize),
-                                                 end=parted.sizeToSectors(sizes[sizes_sorted[each]].start + 2000,
-                                                                          "MB",
-                                                                          device.sectorSize))
-                e_geo = parted.geometry.Geometry(device=device,
-                                                 start=parted.sizeToSectors(common.real_number(sizes[sizes_sorted[each]].end - 2000),
-                                                                            "MB",
-                                                                            device.sectorSize),
-                                                 end=parted.sizeToSectors(sizes[sizes_sorted[each]].end + 2000, "MB",
-                                                                          device.sectorSize))
-                min_size = parted.sizeToSectors(common.real_number((sizes[sizes_sorted[each]].end - sizes[sizes_sorted[each]].start) - 2000),
-                                                "MB",
-                                                device.sectorSize)
-                max_size = parted.sizeToSectors(common.real_number((sizes[sizes_sorted[each]].end - sizes[sizes_sorted[each]].start) + 2000),
-                                                "MB",
-                                                device.sectorSize)
-                const = parted.Constraint(startAlign=device.optimumAlignment,
-                                          endAlign=device.optimumAlignment,
-                                          startRange=s_geo, endRange=e_geo,
-                                          minSize=min_size,
-                                          maxSize=max_size)
-                new_part = parted.Partition(disk=disk,
-                                            type=parted.PARTITION_NORMAL,
-                                            geometry=sizes[sizes_sorted[each]])
-                try:
-                    disk.addPartition(partition=new_part, constraint=const)
-                except:
-                    break
-                made = True
-                break
-        if not made:
-            common.eprint("WAS NOT ABLE TO CREATE ROOT PARTITION. LIKELY NOT ENOUGH SPACE FOR ONE.")
-            common.eprint("INSTALLATION WILL FAIL")
+def __align_up__(sector, grain):
+    """Round sector up to the next multiple of grain"""
+    return -(-sector // grain) * grain
 
-    disk.commit()
-    time.sleep(0.1)
-    __mkfs__(new_part.path, fs)
-    return new_part.path
 
+def plan_layout(length, sector_size, free, efi, home, grain=None):
+    """Work out where every partition goes, without touching the drive
 
-def __make_home__(device, new_start=config["HOME"]["START"],
-                  new_end=config["HOME"]["END"], new_fs=config["HOME"]["fs"]):
-    """Easy sorta-macro to make a home partiton"""
-    return __make_root__(device, start=new_start, end=new_end, fs=new_fs)
+    length: size of the drive, in sectors
+    sector_size: size of a sector, in bytes
+    free: list of (start, end) sectors of free space that can be used.
+          The largest region is the one partitioned.
+    efi: whether an EFI partition is needed
+    home: same as for partition()
+    grain: sectors every partition should start on a multiple of.
+           Defaults to 1 MiB.
 
+    Returns a list of dictionaries, one per partition, in order on the
+    drive. Each has `name' (EFI, ROOT, or HOME), `start' and `end'
+    (sectors, inclusive), `size' (bytes), `fs', and `boot'.
+
+    Raises ValueError if the layout can't fit in the free space given.
+    """
+    if grain in (None, 0):
+        grain = max(1, (1024 ** 2) // sector_size)
+    size = length * sector_size
+    if len(free) == 0:
+        raise ValueError("No free space to partition")
+    start, last = max(free, key=lambda region: region[1] - region[0])
+    cursor = __align_up__(start, grain)
+    layout = []
+
+    def add(name, end, fs, boot=False):
+        """Add a partition from cursor to just before sector end"""
+        nonlocal cursor
+        end = min(end, last + 1)
+        if end <= cursor:
+            raise ValueError(f"Not enough space for { name } partition")
+        layout.append({"name": name, "start": cursor, "end": end - 1,
+                       "size": (end - cursor) * sector_size, "fs": fs,
+                       "boot": boot})
+        cursor = end
 
-def __generate_return_data__(home, efi, part1, part2, part3):
-    """Generate return data for wherever we are in the code"""
-    parts = {}
     if efi:
-        parts["EFI"] = part1
-        parts["ROOT"] = part2
-    else:
-        parts["EFI"] = None
-        parts["ROOT"] = part1
-    if home != "MAKE":
-        parts["HOME"] = home
-    else:
-        if efi:
-            parts["HOME"] = part3
+        efi_size = mb_to_bytes(config["EFI"]["END"] - config["EFI"]["START"])
+        add("EFI", __align_up__(cursor + (efi_size // sector_size), grain),
+            "fat32", boot=True)
+    if home == "MAKE" and size > LIMITER:
+        if size >= gb_to_bytes(config["mdswh"]):
+            root_end = size * 0.35
         else:
-            parts["HOME"] = part2
-    return parts
+            root_end = get_min_root_size()
+        add("ROOT", __align_up__(int(root_end) // sector_size, grain),
+            config["ROOT"]["fs"], boot=not efi)
+        add("HOME", last + 1, config["HOME"]["fs"])
+    else:
+        add("ROOT", last + 1, config["ROOT"]["fs"], boot=not efi)
+    root = [each for each in layout if each["name"] == "ROOT"][0]
+    if root["size"] < config["min root size"] * (1000 ** 2):
+        common.eprint("ROOT PARTITION IS SMALLER THAN RECOMMENDED. INSTALLATION MAY FAIL.")
+    return layout
 
 
-def __make_root_boot__(device):
-    """Make Root partition bootable.
+def discard(drive, start, length):
+    """Tell drive that `length' bytes, starting at `start', are no longer used
 
-This ONLY works if the root partition is the only partition on the drive
-"""
-    disk = parted.Disk(device)
-    partitions = disk.getPrimaryPartitions()
-    partitions[0].setFlag(parted.PARTITION_BOOT)
+    This is the same as `blkdiscard'. Drives that don't support discard,
+    going by /sys/block/*/queue/discard_max_bytes, are skipped.
+
+    Returns True if the bytes were discarded, False otherwise.
+    """
+    info = block_devices.get_device(drive)
+    if info is None or info.get("discard_max_bytes", 0) == 0:
+        common.eprint(f"{ drive } DOES NOT SUPPORT DISCARD. SKIPPING.")
+        return False
+    common.eprint(f"DISCARDING { drive } . . .")
+    fd = os.open(drive, os.O_WRONLY | os.O_CLOEXEC)
+    try:
+        fcntl.ioctl(fd, BLKDISCARD, struct.pack("QQ", start, length))
+    except OSError as error:
+        common.eprint(f"DISCARD ON { drive } FAILED: { error }")
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+
+def __get_grain__(device):
+    """Get the alignment, in sectors, partitions on device should use"""
+    return max(device.optimumAlignment.grainSize,
+               (1024 ** 2) // device.sectorSize)
+
+
+def __apply_layout__(device, disk, layout):
+    """Add every partition in layout to disk, and commit once
+
+    Fills in `path' for each partition in layout.
+    """
+    for each in layout:
+        geometry = parted.geometry.Geometry(device=device, start=each["start"],
+                                            end=each["end"])
+        new_part = parted.Partition(disk=disk, type=parted.PARTITION_NORMAL,
+                                    geometry=geometry)
+        disk.addPartition(partition=new_part,
+                          constraint=parted.Constraint(exactGeom=geometry))
+        if each["boot"]:
+            new_part.setFlag(parted.PARTITION_BOOT)
+        each["path"] = new_part.path
     disk.commit()
+    block_devices.invalidate()
+    # Wait for udev to make the new device files
+    block_devices.wait_for([each["path"] for each in layout])
 
 
 def make_part_boot(part_path):
@@ -549,15 +523,7 @@ def make_part_boot(part_path):
         return
     # We don't have commitment issues here!
     disk.commit()
-
-
-def clobber_disk(device):
-    """Reset drive"""
-    common.eprint("DELETING PARTITIONS.")
-    device.clobber()
-    disk = parted.freshDisk(device, "gpt")
-    disk.commit()
-    return disk
+    block_devices.invalidate()
 
 
 def delete_part(part_path):
@@ -567,9 +533,10 @@ def delete_part(part_path):
     part = disk.getPartitionByPath(part_path)
     disk.deletePartition(part)
     disk.commit()
+    block_devices.invalidate()
 
 
-def partition(root, efi, home, raid_array):
+def partition(root, efi, home, raid_array, dry_run=False, discard_drive=True):
     """Partition drive 'root' for Linux installation
 
 root: needs to be path to installation drive (i.e.: /dev/sda, /dev/nvme0n1)
@@ -580,12 +547,21 @@ Possible values:
   None, 'NULL':            Do not make a home partition, and one does not exist
   'MAKE':                  Make a home partition on the installation drive
   (some partition path):   path to a partition to be used as home directory
+
+The whole layout is worked out first, with plan_layout(), then written
+to the drive in one go.
+
+If dry_run is True, nothing is written, and the layout plan_layout()
+came up with is returned instead, so it can be previewed.
+
+If discard_drive is True and the drive is wiped, the space for the new
+partitions is discarded before making filesystems on them, if the
+drive supports it.
 """
     # Initial set up for partitioning
     common.eprint("\t###\tauto_partioner.py STARTED\t###\t")
-    part1 = None
-    part2 = None
-    part3 = None
+    if dry_run:
+        raid_array = dict(raid_array)
     if raid_array["raid_type"] not in (None, "OEM"):
         if raid_array["raid_type"].lower() == "raid0":
             raid_array["raid_type"] = 0
@@ -606,121 +582,94 @@ Possible values:
                 disks.append(raid_array["disks"][each])
         raid_array["disks"] = disks
     device = parted.getDevice(root)
-    try:
-        disk = parted.Disk(device)
-    except parted._ped.DiskLabelException:
-        common.eprint("NO PARTITION TABLE EXISTS. MAKING NEW ONE . . .")
+    # Only keep what's on the drive if there's a home partition on it to keep
+    clobber = ((home in ("NULL", "null", None, "MAKE", "Home Partition",
+                         "home partition"))
+               or (raid_array["raid_type"] is not None)
+               or (get_drive_path(home) != root))
+    if clobber:
+        # Nothing gets written until the layout has been committed
         disk = parted.freshDisk(device, "gpt")
-    # sectors_to_size() returns size in MBs, multiply by 1 million to convert to bytes
-    size = sectors_to_size(device.length, device.sectorSize) * 1000000
-    if ((home in ("NULL", "null",
-                  None, "MAKE")) and (raid_array["raid_type"] is None)):
-        disk = clobber_disk(device)
-    elif raid_array["raid_type"] is not None:
-        disk = clobber_disk(device)
-        common.eprint("CREATING RAID ARRAY")
-        common.eprint(f"RAID TYPE: {raid_array['raid_type']}")
-        if not make_raid_array(raid_array["disks"], raid_array["raid_type"]):
-            common.eprint("INITIAL RAID ARRAY CREATION FAILED. FORCING . . .")
-            if not make_raid_array(raid_array["disks"], raid_array["raid_type"],
-                                   force=True):
-                common.eprint("FORCED RAID ARRAY CREATION FAILED. BAD DRIVE?")
-                common.eprint("FALLING BACK TO NO HOME PARTITION.")
-                home = None
     else:
-        # we know there is a pre-existing home partition
-        # determine if it is on the same drive and act accordingly
-        home_drive = get_drive_path(home)
-        if home_drive == root:
-            common.eprint("HOME PARTITION EXISTS. NOT DELETING PARTITIONS.")
-        else:
-            disk = clobber_disk(device)
-    if size <= LIMITER:
-        if efi:
-            part1 = __make_efi__(device)
-            part2 = __make_root__(device, end="100%")
-        else:
-            part1 = __make_root__(device, start="0%", end="100%")
-            __make_root_boot__(device)
-        common.eprint("\t###\tauto_partioner.py CLOSED\t###\t")
-        return __generate_return_data__(home, efi, part1, part2, part3)
-    # Handled 16GB drives
-    # From here until 64GB drives, we want our root partition to be AT LEAST
-    # 16GB
-    if home == "MAKE":
-        # If home == "MAKE", we KNOW there are no partitons because we made a
-        # new partition table
-        if size >= gb_to_bytes(config["mdswh"]):
-            root_end = int((size * 0.35) / (1000 ** 2))
-        else:
-            root_end = get_min_root_size()
-        if (efi and (part1 is None)):
-            part1 = __make_efi__(device)
-            part2 = __make_root__(device, end=root_end)
-            part3 = __make_home__(device, new_start=root_end)
-        elif part1 is None:
-            part1 = __make_root__(device, start="0%", end=root_end)
-            __make_root_boot__(device)
-            part2 = __make_home__(device, new_start=root_end)
-        common.eprint("\t###\tauto_partioner.py CLOSED\t###\t")
-        return __generate_return_data__(home, efi, part1, part2, part3)
-    if home in ("NULL", "null", None, "Home Partition", "home partition"):
-        # If home == any possible 'null' value,
-        # we KNOW there are no partitons because we made a
-        # new partition table
-        if efi:
-            part1 = __make_efi__(device)
-            part2 = __make_root__(device, end="100%")
-        else:
-            part1 = __make_root__(device, start="0%", end="100%")
-            __make_root_boot__(device)
-        common.eprint("\t###\tauto_partioner.py CLOSED\t###\t")
-        return __generate_return_data__(home, efi, part1, part2, part3)
-    # This one we need to figure out if the home partiton is on the drive
-    # we are working on or elsewhere
-    if root == get_drive_path(home):
-        # It IS on the same drive. We need to figure out where at and work
-        # around it
-        # NOTE: WE NEED TO WORK IN MB ONLY IN THIS SECTION
-        disk = parted.Disk(device)
-        data = disk.getFreeSpaceRegions()
-        sizes = {}
-        for each in data:
-            sizes[each.length] = each
-        sizes_sorted = sorted(sizes)
-        # Lets make some partitons!
-        if efi:
-            for each in sizes_sorted:
-                if sizes[each].getSize() >= 200:
-                    end = sizes[each].start + parted.sizeToSectors(200, "MB",
-                                                                   device.sectorSize)
-                    end = sectors_to_size(end, device.sectorSize)
-                    part1 = __make_efi__(device, start=sizes[each].start,
-                                         end=end)
-                    part2 = __make_root__(device, start=end,
-                                          end=sizes[each].end)
-                    break
-        else:
-            for each in sizes_sorted:
-                if sizes[each].getSize() >= 200:
-                    part1 = __make_root__(device, start=sizes[each].start + 1,
-                                          end=sizes[each].end - 1)
-                    __make_root_boot__(device)
-                    break
+        common.eprint("HOME PARTITION EXISTS. NOT DELETING PARTITIONS.")
+        try:
+            disk = parted.Disk(device)
+        except parted._ped.DiskLabelException:
+            common.eprint("NO PARTITION TABLE EXISTS. MAKING NEW ONE . . .")
+            disk = parted.freshDisk(device, "gpt")
+    free = [(each.start, each.end) for each in disk.getFreeSpaceRegions()]
+    layout = plan_layout(device.length, device.sectorSize, free, efi, home,
+                         __get_grain__(device))
+    if dry_run:
         common.eprint("\t###\tauto_partioner.py CLOSED\t###\t")
-        return __generate_return_data__(home, efi, part1, part2, part3)
-    # it's elsewhere. We're good.
-    if efi:
-        part1 = __make_efi__(device)
-        part2 = __make_root__(device, end="100%")
-    else:
-        part1 = __make_root__(device, start="0%", end="100%")
-        __make_root_boot__(device)
-    part3 = home
+        return layout
+    if clobber:
+        common.eprint("DELETING PARTITIONS.")
+        device.clobber()
+    __apply_layout__(device, disk, layout)
+    trimmed = False
+    if clobber and discard_drive:
+        # Everything but the partition table itself
+        start = layout[0]["start"] * device.sectorSize
+        end = (layout[-1]["end"] + 1) * device.sectorSize
+        trimmed = discard(root, start, end - start)
+    # Filesystems on different partitions, and the RAID array, don't
+    # depend on each other, so make them all at once
+    jobs = {}
+    for each in layout:
+        jobs[each["path"]] = functools.partial(__mkfs__, each["path"],
+                                               each["fs"], trimmed)
+    if raid_array["raid_type"] is not None:
+        common.eprint("CREATING RAID ARRAY")
+        common.eprint(f"RAID TYPE: {raid_array['raid_type']}")
+        jobs["RAID"] = functools.partial(__make_raid__, raid_array)
+    errors = __run_jobs__(jobs)
+    if "RAID" in errors:
+        common.eprint("FALLING BACK TO NO HOME PARTITION.")
+        home = None
+    for each in layout:
+        if each["path"] in errors:
+            common.eprint(f"COULD NOT MAKE { each['name'] } FILESYSTEM. INSTALLATION WILL LIKELY FAIL.")
     # Figure out what parts are for what
     # Return that data as a dictonary
+    parts = {"EFI": None, "ROOT": None, "HOME": None}
+    for each in layout:
+        parts[each["name"]] = each["path"]
+    if home != "MAKE":
+        parts["HOME"] = home
     common.eprint("\t###\tauto_partioner.py CLOSED\t###\t")
-    return __generate_return_data__(home, efi, part1, part2, part3)
+    return parts
+
+
+def preview(root, efi, home, raid_array):
+    """Describe what partition() would do, for showing to the user
+
+    Takes the same arguments as partition(). Returns one line per
+    partition, such as `ROOT: 163.9G btrfs'. Nothing is written to the
+    drive. If the layout can't be worked out, an empty list is returned.
+    """
+    try:
+        layout = partition(root, efi, home, raid_array, dry_run=True)
+    except Exception as error:
+        # A preview failing should never stop installation. partition()
+        # will fail properly, with a real error, if there's a problem.
+        common.eprint(f"COULD NOT PREVIEW PARTITIONING: { error }")
+        return []
+    return [f"{ each['name'] }: { block_devices.human_size(each['size']) } { each['fs'] }"
+            for each in layout]
+
+
+def __make_raid__(raid_array):
+    """Make the RAID array, forcing it if need be
+
+    Raises OSError if it can't be made either way.
+    """
+    if make_raid_array(raid_array["disks"], raid_array["raid_type"]):
+        return
+    common.eprint("INITIAL RAID ARRAY CREATION FAILED. FORCING . . .")
+    if not make_raid_array(raid_array["disks"], raid_array["raid_type"],
+                           force=True):
+        raise OSError("FORCED RAID ARRAY CREATION FAILED. BAD DRIVE?")
 
 
 def make_raid_array(disks: list, raid_type: int, force=False) -> bool:
@@ -779,6 +728,8 @@ def make_raid_array(disks: list, raid_type: int, force=False) -> bool:
         return True
     except subprocess.CalledProcessError:
         return False
+    finally:
+        block_devices.invalidate()
 
 
 def get_drive_count() -> int:
@@ -786,14 +737,9 @@ def get_drive_count() -> int:
 
     This is all drives, excluding /dev/srX and /dev/fdX
     """
-    drives = subprocess.check_output(["lsblk", "--json", "--output", "path,type"]).decode()
-    drives = json.loads(drives)["blockdevices"]
     count = 0
-    for each in drives:
-        if each["type"] != "disk":
-            continue
-        if each["path"].split("/")[-1][:2] not in ("fd", "sr"):
-            if "loop" not in each["path"]:
-                count += 1
+    for each in block_devices.get_disks():
+        if each["kname"][:2] not in ("fd", "sr"):
+            count += 1
     return 1
     return count
@@ -0,0 +1,373 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  block_devices.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""In-process inventory of block devices
+
+Built from /sys/block and the udev database, so looking up a device never
+needs to shell out to `lsblk'. The inventory is rebuilt the next time it
+is used after udev reports a change to a block device, or after
+invalidate() is called.
+
+Also has wait_for(), to wait until udev is done with a device, and
+is_mounted(), which checks /proc/self/mountinfo.
+"""
+import copy
+import os
+import select
+import socket
+import stat
+import subprocess
+import time
+
+SYS_BLOCK = "/sys/block"
+UDEV_DATA = "/run/udev/data"
+# Exists while udev has events it hasn't finished with
+UDEV_QUEUE = "/run/udev/queue"
+MOUNTINFO = "/proc/self/mountinfo"
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast groups: 1 is raw kernel events, 2 is events udev has finished with
+UEVENT_GROUPS = 1 | 2
+
+__cache__ = {"tree": None, "index": {}}
+__monitor__ = {"socket": None, "tried": False}
+
+
+def __read__(path, default=None):
+    """Read a sysfs attribute, stripped of whitespace"""
+    try:
+        with open(path, "r") as file:
+            return file.read().strip()
+    except (FileNotFoundError, OSError):
+        return default
+
+
+def __open_monitor__():
+    """Start listening for uevents, if we can"""
+    __monitor__["tried"] = True
+    try:
+        sock = socket.socket(socket.AF_NETLINK,
+                             socket.SOCK_DGRAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+                             NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, UEVENT_GROUPS))
+    except (OSError, AttributeError):
+        # No netlink access. We'll just rebuild every time instead.
+        return
+    __monitor__["socket"] = sock
+
+
+def __changed__():
+    """Drain pending uevents. Returns True if any were for block devices."""
+    if not __monitor__["tried"]:
+        __open_monitor__()
+    sock = __monitor__["socket"]
+    if sock is None:
+        return True
+    changed = False
+    while True:
+        try:
+            data = sock.recv(8192)
+        except BlockingIOError:
+            return changed
+        except OSError:
+            # Most likely ENOBUFS: events were dropped, so assume the worst
+            changed = True
+            continue
+        if b"SUBSYSTEM=block" in data:
+            changed = True
+
+
+def __open_listener__():
+    """Get a socket that gets every event udev finishes with, or None"""
+    try:
+        sock = socket.socket(socket.AF_NETLINK,
+                             socket.SOCK_DGRAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+                             NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, 2))
+    except (OSError, AttributeError):
+        return None
+    return sock
+
+
+def __is_ready__(path):
+    """Check if path is a block device udev is done setting up"""
+    try:
+        info = os.stat(path)
+    except (FileNotFoundError, OSError):
+        return False
+    if not stat.S_ISBLK(info.st_mode):
+        return False
+    if not os.path.isdir(UDEV_DATA):
+        # No udev. The device file existing is all we get.
+        return True
+    dev = f"{os.major(info.st_rdev)}:{os.minor(info.st_rdev)}"
+    return os.path.exists(f"{UDEV_DATA}/b{dev}")
+
+
+def wait_for(paths, timeout=10):
+    """Wait until udev is done with every device in paths
+
+    That is, until each one is a block device udev has a record of, and
+    udev has nothing left in its queue. Rather than sleeping, this wakes
+    up whenever udev finishes with an event. Falls back on `udevadm
+    settle' if udev events can't be listened for.
+
+    Returns True if everything was ready before timeout seconds were up,
+    False otherwise.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    deadline = time.monotonic() + timeout
+    sock = __open_listener__()
+    try:
+        while True:
+            if (all(__is_ready__(each) for each in paths)
+                    and not os.path.exists(UDEV_QUEUE)):
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if sock is None:
+                command = ["udevadm", "settle", f"--timeout={max(int(remaining), 1)}"]
+                for each in paths:
+                    command.append(f"--exit-if-exists={each}")
+                try:
+                    subprocess.call(command)
+                except FileNotFoundError:
+                    pass
+                return all(__is_ready__(each) for each in paths)
+            # The queue emptying isn't an event of its own, so don't wait
+            # too long between checks
+            if len(select.select([sock], [], [], min(remaining, 0.1))[0]) > 0:
+                try:
+                    while True:
+                        sock.recv(8192)
+                except (BlockingIOError, OSError):
+                    pass
+    finally:
+        if sock is not None:
+            sock.close()
+
+
+def __unescape__(field):
+    """Undo the octal escapes in a /proc/self/mountinfo field"""
+    return field.encode().decode("unicode_escape")
+
+
+def get_mounts():
+    """Get everything currently mounted, from /proc/self/mountinfo
+
+    Each mount is a dictionary with `source', `target', `fstype', and
+    `dev' (major:minor).
+    """
+    mounts = []
+    with open(MOUNTINFO, "r") as file:
+        for line in file:
+            fields = line.split()
+            # Optional fields end with a lone `-'
+            separator = fields.index("-")
+            mounts.append({"dev": fields[2],
+                           "target": __unescape__(fields[4]),
+                           "fstype": fields[separator + 1],
+                           "source": __unescape__(fields[separator + 2])})
+    return mounts
+
+
+def is_mounted(device, path):
+    """Check if device is mounted at path"""
+    path = os.path.realpath(path)
+    device = os.path.realpath(device)
+    try:
+        info = os.stat(device)
+        dev = f"{os.major(info.st_rdev)}:{os.minor(info.st_rdev)}"
+    except (FileNotFoundError, OSError):
+        dev = None
+    for each in get_mounts():
+        if each["target"] != path:
+            continue
+        # btrfs reports a made up major:minor, so check the source too
+        if each["dev"] == dev or os.path.realpath(each["source"]) == device:
+            return True
+    return False
+
+
+def __udev_properties__(dev):
+    """Get the udev properties for the device numbered `dev' (major:minor)"""
+    properties = {}
+    data = __read__(f"{UDEV_DATA}/b{dev}", "")
+    for line in data.split("\n"):
+        if line[:2] == "E:" and "=" in line:
+            key, value = line[2:].split("=", 1)
+            properties[key] = value
+    return properties
+
+
+def __get_type__(name, sys_path):
+    """Work out the device type the same way lsblk reports it"""
+    if name[:4] == "loop":
+        return "loop"
+    if name[:2] == "sr":
+        return "rom"
+    if name[:2] == "md":
+        return __read__(f"{sys_path}/md/level", "raid")
+    if name[:3] == "dm-":
+        uuid = __read__(f"{sys_path}/dm/uuid", "")
+        if uuid[:5] == "CRYPT":
+            return "crypt"
+        if uuid[:3] == "LVM":
+            return "lvm"
+        return "dm"
+    return "disk"
+
+
+def __make_entry__(name, sys_path, dev_type):
+    """Build the dictionary describing a single device"""
+    dev = __read__(f"{sys_path}/dev", "")
+    properties = __udev_properties__(dev)
+    path = f"/dev/{name}"
+    if name[:3] == "dm-":
+        mapper = __read__(f"{sys_path}/dm/name")
+        if mapper is not None:
+            path = f"/dev/mapper/{mapper}"
+    fstype = properties.get("ID_FS_TYPE")
+    if fstype == "":
+        fstype = None
+    return {"name": path,
+            "kname": name,
+            "dev": dev,
+            "size": int(__read__(f"{sys_path}/size", "0")) * 512,
+            "type": dev_type,
+            "fstype": fstype,
+            "uuid": properties.get("ID_FS_UUID"),
+            "partuuid": properties.get("ID_PART_ENTRY_UUID")}
+
+
+def refresh():
+    """Rebuild the inventory from sysfs and the udev database"""
+    tree = []
+    index = {}
+    try:
+        names = sorted(os.listdir(SYS_BLOCK))
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        sys_path = f"{SYS_BLOCK}/{name}"
+        disk = __make_entry__(name, sys_path, __get_type__(name, sys_path))
+        disk["rotational"] = __read__(f"{sys_path}/queue/rotational", "1") == "1"
+        disk["discard_max_bytes"] = int(__read__(f"{sys_path}/queue/discard_max_bytes", "0"))
+        disk["removable"] = __read__(f"{sys_path}/removable", "0") == "1"
+        children = []
+        for each in sorted(os.listdir(sys_path)):
+            if os.path.exists(f"{sys_path}/{each}/partition"):
+                part = __make_entry__(each, f"{sys_path}/{each}", "part")
+                part["number"] = int(__read__(f"{sys_path}/{each}/partition", "0"))
+                part["disk"] = disk["name"]
+                children.append(part)
+        children.sort(key=lambda part: part["number"])
+        if len(children) > 0:
+            disk["children"] = children
+        tree.append(disk)
+        index[disk["name"]] = disk
+        for each in children:
+            index[each["name"]] = each
+    __cache__["tree"] = tree
+    __cache__["index"] = index
+
+
+def invalidate():
+    """Force the inventory to be rebuilt next time it is used
+
+    Call this after changing a partition table or making a filesystem.
+    """
+    __cache__["tree"] = None
+
+
+def __current__():
+    """Make sure the inventory is up to date"""
+    if __changed__() or __cache__["tree"] is None:
+        refresh()
+
+
+def get_tree(include_loop=False):
+    """Get all block devices, laid out the same as `lsblk --json --paths'
+
+    Each partition is listed in the `children' list of its disk.
+    A copy is returned, so callers are free to modify it.
+    """
+    __current__()
+    tree = __cache__["tree"]
+    if not include_loop:
+        tree = [each for each in tree if each["type"] != "loop"]
+    return copy.deepcopy(tree)
+
+
+def get_disks():
+    """Get all whole disks that could be installed to"""
+    return [each for each in get_tree() if each["type"] == "disk"]
+
+
+def get_device(path):
+    """Get a single disk or partition by path. Returns None if not found."""
+    __current__()
+    device = __cache__["index"].get(os.path.realpath(path))
+    if device is None:
+        device = __cache__["index"].get(path)
+    return copy.deepcopy(device)
+
+
+def get_partitions(disk):
+    """Get all partitions on `disk'"""
+    device = get_device(disk)
+    if device is None:
+        return []
+    return device.get("children", [])
+
+
+def human_size(size):
+    """Format `size' (in bytes) the same way `lsblk' does. e.g.: 465.8G"""
+    size = float(size)
+    for suffix in ("B", "K", "M", "G", "T", "P"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        suffix = "E"
+    size = round(size, 1)
+    if size == int(size):
+        return f"{int(size)}{suffix}"
+    return f"{size}{suffix}"
+
+
+def get_display_tree():
+    """Get all block devices, laid out like `lsblk --json -o NAME,SIZE,TYPE,FSTYPE'
+
+    Names are kernel names (sda, not /dev/sda) and sizes are human readable
+    strings, as they are shown to the user.
+    """
+    def display(device):
+        output = {"name": device["kname"], "size": human_size(device["size"]),
+                  "type": device["type"], "fstype": device["fstype"]}
+        if "children" in device:
+            output["children"] = [display(each) for each in device["children"]]
+        return output
+
+    return [display(each) for each in get_tree(include_loop=True)]
@@ -23,11 +23,25 @@
 #
 """Ping servers to see if we have internet"""
 import json
+import time
+import concurrent.futures as futures
+import dns.exception
 import dns.resolver as res
 import common
 
 
-def ping(mirror):
+# How long a single DNS lookup may take, in seconds
+TIMEOUT = 3
+# How long all lookups together may take, in seconds
+DEADLINE = 5
+# How long a result is reused for, in seconds
+TTL = 300
+SETTINGS = "/etc/edamame/settings.json"
+
+__cache__ = {"result": None, "time": 0}
+
+
+def ping(mirror, timeout=TIMEOUT):
     """Try doing a DNS resolution on the mirrors"""
     # We need just the domain name, so we have to parse things down a bit
     if mirror[:4] == "http":
@@ -35,39 +49,59 @@ def ping(mirror):
     if mirror[-1] == "/":
         mirror = mirror[:-1]
     try:
-        res.resolve(mirror, "A")
+        res.Resolver().resolve(mirror, "A", lifetime=timeout)
         return True
-    except (res.NoNameservers, res.NoAnswer):
+    except (res.NoNameservers, res.NoAnswer, res.NoResolverConfiguration,
+            dns.exception.Timeout):
         return False
     except res.NXDOMAIN:
         return None
 
 
-def has_internet():
+def has_internet(refresh=False):
     """Check for internet, using mirrors and ping counts defined in
-    the default `edamame` config file."""
+    the default `edamame` config file.
+
+    All servers are tried at once, and we stop as soon as most of them
+    agree. Servers that haven't answered by DEADLINE count as failures.
+    The result is reused for TTL seconds unless `refresh' is True.
+    """
+    if ((not refresh) and (__cache__["result"] is not None) and
+            (time.monotonic() - __cache__["time"] < TTL)):
+        return __cache__["result"]
     # Read Mirrors file
-    with open("/etc/edamame/settings.json", "r") as mirrors_file:
+    with open(SETTINGS, "r") as mirrors_file:
         mirrors = json.load(mirrors_file)
 
     mirrors = mirrors["ping servers"]
 
     # get only the unique mirrors
     mirrors = common.unique(mirrors)
-    # Get our ping times
-    results = []
-    try:
-        # Ping all listed servers, in case one or more is blocked
-        for each in mirrors:
-            results.append(ping(each))
-    except:
+    if len(mirrors) == 0:
+        common.eprint("No servers to ping. Assuming no internet.")
         return False
+    majority = (len(mirrors) // 2) + 1
     true = 0
     false = 0
-    for each in results:
-        if each:
-            true += 1
-        else:
-            false += 1
+    # Ping all listed servers, in case one or more is blocked
+    pool = futures.ThreadPoolExecutor(max_workers=len(mirrors))
+    jobs = [pool.submit(ping, each) for each in mirrors]
+    try:
+        for each in futures.as_completed(jobs, timeout=DEADLINE):
+            try:
+                result = each.result()
+            except Exception:
+                result = False
+            if result:
+                true += 1
+            else:
+                false += 1
+            if majority in (true, false):
+                break
+    except futures.TimeoutError:
+        common.eprint("Some servers did not respond in time. Counting them as unreachable.")
+    pool.shutdown(wait=False, cancel_futures=True)
 
-    return (true > false)
+    __cache__["result"] = (true > len(mirrors) - true)
+    __cache__["time"] = time.monotonic()
+    return __cache__["result"]
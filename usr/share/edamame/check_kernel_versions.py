@@ -27,21 +27,96 @@ kernel cannot be booted.
 """
 import tarfile as tar
 import subprocess
+import json
 import os
 import common
 
 
+ARCHIVES = ("/usr/share/edamame/kernel.tar.xz",
+            "/usr/share/edamame/kernel.tar.7z")
+# Generated by build-common.sh, next to the archive and inside it
+MANIFEST = "/usr/share/edamame/kernel.json"
+# Where we keep what we learned from the archive if there is no manifest
+CACHE = "/tmp/edamame/kernel.json"
+
+
+def __read_json__(path):
+    """Read a JSON file, returning None if it's missing or broken"""
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return None
+
+
+def __parse_deb_name__(name):
+    """Get manifest details for a package from its file name alone
+
+    Package files are named <package>_<version>_<arch>.deb, with any ':'
+    in the version written as %3a.
+    """
+    fields = name[:-4].split("_")
+    return {"file": name,
+            "package": fields[0],
+            "version": fields[1].replace("%3a", ":") if len(fields) > 1 else None,
+            "sha256": None}
+
+
+def __scan_archive__():
+    """List the packages in the kernel archive
+
+    The archive is read as a stream, in a single pass, and the result is
+    cached so it never has to be read again.
+    """
+    for archive in ARCHIVES:
+        if os.path.exists(archive):
+            break
+    packages = []
+    with tar.open(archive, "r|*") as tar_file:
+        for member in tar_file:
+            name = member.name.split("/")[-1]
+            if not member.isfile() or name[-4:] != ".deb":
+                continue
+            packages.append(__parse_deb_name__(name))
+    manifest = {"version": None, "packages": packages}
+    try:
+        common.recursive_mkdir(os.path.dirname(CACHE))
+        with open(CACHE, "w") as file:
+            json.dump(manifest, file, indent=1)
+    except OSError:
+        common.eprint(f"Could not cache kernel archive contents to {CACHE}")
+    return manifest
+
+
+def get_manifest(local_repo):
+    """Get the kernel manifest for the local repo or included kernel archive
+
+    Returns a dictionary with the following values:
+        version : kernel release the packages are for, None if unknown
+        packages : list of dictionaries, each with "file", "package",
+                   "version", and "sha256" keys
+    """
+    if os.path.exists(local_repo):
+        manifest = __read_json__(f"{local_repo}/manifest.json")
+        if manifest is not None:
+            return manifest
+        return {"version": None,
+                "packages": [__parse_deb_name__(each)
+                             for each in sorted(os.listdir(local_repo))
+                             if each[-4:] == ".deb"]}
+    for each in (MANIFEST, CACHE):
+        manifest = __read_json__(each)
+        if manifest is not None:
+            return manifest
+    return __scan_archive__()
+
+
 def __get_file_version__(local_repo, kernel_meta_pkg):
-    """Get kernel version in included kernel archive"""
-    if not os.path.exists(local_repo):
-        try:
-            tar_file = tar.open("/usr/share/edamame/kernel.tar.xz")
-        except FileNotFoundError:
-            tar_file = tar.open("/usr/share/edamame/kernel.tar.7z")
-        files = tar_file.getnames()
-        tar_file.close()
-    else:
-        files = os.listdir(local_repo)
+    """Get kernel version in local repo or included kernel archive"""
+    manifest = get_manifest(local_repo)
+    if manifest["version"] is not None:
+        return manifest["version"]
+    files = [each["file"] for each in manifest["packages"]]
     for each in range(len(files) - 1, -1, -1):
         if files[each] in ("kernel", "kernel/linux-meta"):
             del files[each]
@@ -33,9 +33,9 @@ import traceback
 import psutil
 import UI
 import installer
-import check_internet
 import check_kernel_versions
 import common
+import progress_channel
 import auto_partitioner
 import oem
 import modules
@@ -221,9 +221,7 @@ if INSTALL:
             command.append(gui)
         process = subprocess.Popen(command)
         pid = process.pid
-        SETTINGS["INTERNET"] = check_internet.has_internet()
         installer.install(SETTINGS, CONFIG["local_repo"], ui_type=gui)
-        shutil.rmtree("/mnt/repo")
         common.eprint(f"    ###    {sys.argv[0]} CLOSED    ###    ")
         copy_log_to_disk()
         command = ["su", "live", "-c",
@@ -239,13 +237,18 @@ if INSTALL:
         subprocess.Popen(command)
         os.kill(pid, 15)
     except Exception as error:
-        os.kill(pid, 15)
+        # Leave the progress window up, showing the error, until the
+        # error dialog is closed
+        progress_channel.error(str(error))
         common.eprint(f"\nAn Error has occured:\n{error}\n")
         common.eprint(traceback.format_exc())
         print(f"\nAn Error has occured:\n{error}\n")
         print(traceback.format_exc())
         copy_log_to_disk()
-        UI.error.show_error("""\n\tError detected.\t
+        try:
+            UI.error.show_error("""\n\tError detected.\t
 \tPlease see /tmp/edamame.log for details.\t\n""")
+        finally:
+            os.kill(pid, 15)
 else:
     shutdown(BOOT_TIME, immerse, 1)
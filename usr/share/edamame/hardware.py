@@ -0,0 +1,170 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  hardware.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""In-process inventory of PCI hardware
+
+Built from /sys/bus/pci/devices, with names from the pci.ids database,
+so nothing needs to shell out to `lspci'. The inventory is read once and
+kept for the life of the process.
+"""
+import copy
+import os
+
+SYS_PCI = "/sys/bus/pci/devices"
+PCI_IDS = ("/usr/share/misc/pci.ids", "/usr/share/hwdata/pci.ids")
+
+# PCI vendor IDs we care about
+NVIDIA = 0x10de
+BROADCOM = 0x14e4
+REALTEK = 0x10ec
+# PCI base classes we care about
+NETWORK = 0x02
+DISPLAY = 0x03
+
+__cache__ = {"devices": None, "by_vendor": {}, "by_class": {}}
+
+
+def __read_hex__(path):
+    """Read a hexadecimal sysfs attribute as an int"""
+    try:
+        with open(path, "r") as file:
+            return int(file.read().strip(), 16)
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+
+
+def __read_names__(devices):
+    """Get names for the vendors, devices and classes in `devices'
+
+    Only names for hardware we actually have are kept.
+    """
+    vendors = {each["vendor"] for each in devices}
+    models = {(each["vendor"], each["device"]) for each in devices}
+    classes = {each["class"] >> 16 for each in devices}
+    subclasses = {each["class"] >> 8 for each in devices}
+    names = {"vendor": {}, "device": {}, "class": {}}
+    for path in PCI_IDS:
+        if os.path.exists(path):
+            break
+    else:
+        return names
+    vendor = None
+    base_class = None
+    with open(path, "r", errors="replace") as file:
+        for line in file:
+            if line[0] in ("#", "\n") or line[:2] == "\t\t":
+                continue
+            if line[:2] == "C ":
+                vendor = None
+                base_class = int(line[2:4], 16)
+                if base_class in classes:
+                    names["class"][base_class] = line[6:].strip()
+            elif line[0] != "\t":
+                base_class = None
+                vendor = int(line[:4], 16)
+                if vendor in vendors:
+                    names["vendor"][vendor] = line[6:].strip()
+            elif base_class is not None:
+                subclass = (base_class << 8) | int(line[1:3], 16)
+                if subclass in subclasses:
+                    names["class"][subclass] = line[5:].strip()
+            elif vendor in vendors:
+                device = int(line[1:5], 16)
+                if (vendor, device) in models:
+                    names["device"][(vendor, device)] = line[7:].strip()
+    return names
+
+
+def refresh():
+    """Rebuild the inventory"""
+    devices = []
+    try:
+        slots = sorted(os.listdir(SYS_PCI))
+    except FileNotFoundError:
+        slots = []
+    for slot in slots:
+        path = f"{SYS_PCI}/{slot}"
+        device = {"slot": slot,
+                  "vendor": __read_hex__(f"{path}/vendor"),
+                  "device": __read_hex__(f"{path}/device"),
+                  "class": __read_hex__(f"{path}/class"),
+                  "revision": __read_hex__(f"{path}/revision")}
+        if None in (device["vendor"], device["device"], device["class"]):
+            continue
+        devices.append(device)
+    names = __read_names__(devices)
+    by_vendor = {}
+    by_class = {}
+    for each in devices:
+        each["vendor_name"] = names["vendor"].get(each["vendor"], f"Vendor {each['vendor']:04x}")
+        each["device_name"] = names["device"].get((each["vendor"], each["device"]),
+                                                  f"Device {each['device']:04x}")
+        each["class_name"] = names["class"].get(each["class"] >> 8,
+                                                names["class"].get(each["class"] >> 16,
+                                                                   f"Class {each['class'] >> 8:04x}"))
+        by_vendor.setdefault(each["vendor"], []).append(each)
+        by_class.setdefault(each["class"] >> 16, []).append(each)
+    __cache__["devices"] = devices
+    __cache__["by_vendor"] = by_vendor
+    __cache__["by_class"] = by_class
+
+
+def get_devices(vendor=None, base_class=None):
+    """Get PCI devices, optionally only those from `vendor' and/or in `base_class'
+
+    Each device is a dictionary with the following values:
+        slot : PCI address, e.g. "0000:01:00.0"
+        vendor : vendor ID as int
+        device : device ID as int
+        class : 24 bit class code as int
+        revision : revision as int, or None
+        vendor_name : vendor name as str
+        device_name : device name as str
+        class_name : class name as str
+    """
+    if __cache__["devices"] is None:
+        refresh()
+    if vendor is not None:
+        devices = __cache__["by_vendor"].get(vendor, [])
+        if base_class is not None:
+            devices = [each for each in devices if each["class"] >> 16 == base_class]
+    elif base_class is not None:
+        devices = __cache__["by_class"].get(base_class, [])
+    else:
+        devices = __cache__["devices"]
+    return copy.deepcopy(devices)
+
+
+def describe(device):
+    """Describe a device the way `lspci -nn' would"""
+    line = f"{device['slot'][5:]} {device['class_name']} [{device['class'] >> 8:04x}]: "
+    line += f"{device['vendor_name']} {device['device_name']} "
+    line += f"[{device['vendor']:04x}:{device['device']:04x}]"
+    if device["revision"] not in (None, 0):
+        line += f" (rev {device['revision']:02x})"
+    return line
+
+
+def get_report():
+    """Get a description of every PCI device, one per line"""
+    return [describe(each) for each in get_devices()]
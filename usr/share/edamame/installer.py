@@ -24,59 +24,194 @@
 """Main module controling the installation process"""
 from subprocess import Popen, check_output, check_call, CalledProcessError
 import os
+import re
 import shutil
 import tarfile as tar
 import json
-import time
+import fcntl
 import UI
 import modules
 import chroot
 import common
+import check_internet
 import auto_partitioner
+import block_devices
+import unsquash
+import progress_channel
 
 
-def __mount__(device, path_dir, ui):
+REPO_MOUNT = "/mnt/repo"
+
+
+def __mount__(device, path_dir, ui, profiles=None):
     """Mount device at path
     It would be much lighter weight to use ctypes to do this
     But, that keeps throwing an 'Invalid Argument' error.
     Calling Mount with check_call is the safer option.
+
+    Before each attempt, this waits for udev to be done with device, so
+    it only waits as long as it needs to.
+
+    profiles should be the `mount_options' entry from settings.json. The
+    `install' options for device's filesystem are used, if there are any.
+    If mounting with them fails, plain `rw' is used instead.
     """
-    retry_count = 0
-    while True:
-        if retry_count > 5:
-            ui.error.show_error(f"\n\tCOULD NOT MOUNT {device} AT {path_dir}!\t\n")
-        breakout = False
+    if profiles is None:
+        profiles = {}
+    fallback = False
+    for attempt in range(5):
+        if not block_devices.wait_for([device]):
+            print(f"{device} still not ready. Trying anyways...")
+        # Look this up only once udev is done, so a freshly made
+        # filesystem is reported correctly
+        options = "rw"
+        if not fallback:
+            options = profiles.get("install", {}).get(auto_partitioner.get_fs(device),
+                                                      "rw")
         try:
-            check_call(["mount", "-o", "rw", device, path_dir])
+            check_call(["mount", "-o", options, device, path_dir])
         except CalledProcessError:
-            print("Mounting Drive Failed. Delaying and retrying...")
-            retry_count += 1
-            time.sleep(0.1)
+            if options != "rw":
+                print(f"Mounting with {options} failed. Retrying with rw...")
+                fallback = True
+            else:
+                print("Mounting Drive Failed. Retrying...")
             continue
-        mountpoints = json.loads(check_output(["lsblk", "--json", "--output", "path,mountpoints", device]).decode())["blockdevices"]
-        for each in mountpoints:
-            if each["path"] == device:
-                if path_dir in each["mountpoints"]:
-                    breakout = True
+        if block_devices.is_mounted(device, path_dir):
+            return
+        print("Drive Mounting failed silently. Retrying...")
+    ui.error.show_error(f"\n\tCOULD NOT MOUNT {device} AT {path_dir}!\t\n")
+
+
+def __set_fstab_options__(fstab_contents, profiles):
+    """Swap the install-time mount options in fstab_contents for long term ones
+
+    Only filesystems with `final' options in profiles are changed, and
+    only their options field. Every other line, such as the ESP's or
+    swap's, is left exactly as genfstab wrote it.
+    """
+    final = profiles.get("final", {})
+    lines = []
+    for line in fstab_contents.split("\n"):
+        fields = line.split()
+        if len(fields) >= 4 and fields[0][0] != "#" and fields[2] in final:
+            # Keep genfstab's own spacing between fields
+            parts = re.split(r"(\s+)", line)
+            offset = 2 if parts[0] == "" else 0
+            parts[offset + 6] = final[fields[2]]
+            line = "".join(parts)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def __extract_kernel__(local_repo):
+    """Extract kernel.tar.xz straight into local_repo
+
+    The archive keeps packages in kernel/<branch>/, but we want them all at
+    the top level of local_repo, so the leading directories are dropped
+    as each file is extracted.
+    """
+    with tar.open("/usr/share/edamame/kernel.tar.xz") as tar_file:
+        for member in tar_file:
+            if not member.isfile():
+                continue
+            member.name = os.path.basename(member.name)
+            tar_file.extract(member, path=local_repo)
+
+
+def __copy_file__(source, dest):
+    """Copy a file, sharing data blocks with the source where possible"""
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        try:
+            # FICLONE: make a reflink copy on filesystems that support it
+            fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())
+            return
+        except OSError:
+            pass
+        size = os.fstat(src.fileno()).st_size
+        try:
+            while size > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), size)
+                if copied == 0:
                     break
-        if breakout:
-            break
-        print("Drive Mounting failed silently. Delaying and Retrying...")
-        retry_count += 1
-        time.sleep(0.1)
+                size -= copied
+        except OSError:
+            # Not supported between these two filesystems
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst)
 
 
+def __provide_repo__(local_repo):
+    """Make local_repo available at /mnt/repo
 
+    Bind mount it read-only if we can, so nothing gets copied. If that
+    fails, copy it instead.
+    """
+    common.recursive_mkdir(REPO_MOUNT)
+    try:
+        check_call(["mount", "--bind", local_repo, REPO_MOUNT])
+    except CalledProcessError:
+        common.eprint("Could not bind mount local repo. Copying it instead.")
+        for each in os.listdir(local_repo):
+            if os.path.isfile(f"{local_repo}/{each}"):
+                __copy_file__(f"{local_repo}/{each}", f"{REPO_MOUNT}/{each}")
+        return
+    try:
+        check_call(["mount", "-o", "remount,bind,ro", REPO_MOUNT])
+    except CalledProcessError:
+        common.eprint("Could not make /mnt/repo read-only. Continuing anyway.")
 
-def __update__(percentage):
-    """Update progress percentage file"""
+
+def __remove_repo__():
+    """Remove /mnt/repo, whether it was bind mounted or copied"""
+    if os.path.ismount(REPO_MOUNT):
+        check_call(["umount", REPO_MOUNT])
+        os.rmdir(REPO_MOUNT)
+    elif os.path.exists(REPO_MOUNT):
+        shutil.rmtree(REPO_MOUNT)
+
+
+def __provide_package_cache__(package_cache):
+    """Make the package cache from settings.json available inside the chroot
+
+    Returns the package cache settings to use from inside the chroot, or
+    None if there isn't a usable one.
+    """
+    if ((package_cache in (None, {})) or
+            (package_cache.get("type") not in ("directory", "http"))):
+        return None
+    if package_cache["type"] == "http":
+        return package_cache
+    if not os.path.isdir(package_cache["location"]):
+        common.eprint(f"Package cache {package_cache['location']} does not exist. Not using it.")
+        return None
+    mount_point = "/mnt" + modules.transaction.CACHE_MOUNT
+    common.recursive_mkdir(mount_point)
     try:
-        with open("/tmp/edamame-progress.log", "w+") as progress:
-            progress.write(str(percentage))
-    except PermissionError:
-        os.chmod("/tmp/edamame-progress.log", 0o666)
-        with open("/tmp/edamame-progress.log", "w+") as progress:
-            progress.write(str(percentage))
+        check_call(["mount", "--bind", package_cache["location"], mount_point])
+    except CalledProcessError:
+        common.eprint(f"Could not mount package cache {package_cache['location']}. Not using it.")
+        return None
+    return {"type": "directory", "location": modules.transaction.CACHE_MOUNT}
+
+
+def __remove_package_cache__():
+    """Unmount the package cache from the chroot, if it was mounted"""
+    mount_point = "/mnt" + modules.transaction.CACHE_MOUNT
+    if os.path.ismount(mount_point):
+        check_call(["umount", mount_point])
+    for each in (mount_point, os.path.dirname(mount_point)):
+        try:
+            os.rmdir(each)
+        except OSError:
+            pass
+
+
+def __update__(percentage):
+    """Update progress percentage"""
+    progress_channel.percent(percentage)
 
 
 def install(settings: dict, local_repo: str, ui_type: str) -> None:
@@ -84,6 +219,8 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
 
     settings should be a dictionary with the following values:
         AUTO_PART : bool
+        DISCARD : bool, whether to discard the drive when AUTO_PART wipes it.
+                  Defaults to True.
         ROOT : device path as str
         HOME : device path as str
         EFI : device path
@@ -110,11 +247,14 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
     ui = UI.load_UI(ui_type)
     work_dir = "/tmp/quick-install_working-dir"
     # STEP 1: Partion and format the drive ( if needed )
+    progress_channel.stage("Partitioning")
     if settings["AUTO_PART"]:
         partitioning = auto_partitioner.partition(settings["ROOT"],
                                                   settings["EFI"],
                                                   settings["HOME"],
-                                                  settings["raid_array"])
+                                                  settings["raid_array"],
+                                                  discard_drive=settings.get("DISCARD",
+                                                                             True))
         settings["ROOT"] = partitioning["ROOT"]
         settings["EFI"] = partitioning["EFI"]
         settings["HOME"] = partitioning["HOME"]
@@ -123,11 +263,13 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
             auto_partitioner.make_part_boot(settings["ROOT"])
         else:
             auto_partitioner.make_part_boot(settings["EFI"])
-    if os.path.exists("/tmp/edamame-progress.log"):
-        os.remove("/tmp/edamame-progress.log")
     __update__(12)
+    with open("/etc/edamame/settings.json", "r") as file:
+        config = json.loads(file.read())
+    mount_options = config.get("mount_options", {})
     # STEP 2: Mount the new partitions
-    __mount__(settings["ROOT"], "/mnt", ui)
+    progress_channel.stage("Mounting partitions")
+    __mount__(settings["ROOT"], "/mnt", ui, mount_options)
     if settings["EFI"] not in ("NULL", None, "", False):
         try:
             os.mkdir("/mnt/boot")
@@ -137,13 +279,13 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
             os.mkdir("/mnt/boot/efi")
         except FileExistsError:
             pass
-        __mount__(settings["EFI"], "/mnt/boot/efi", ui)
+        __mount__(settings["EFI"], "/mnt/boot/efi", ui, mount_options)
     if settings["HOME"] not in ("NULL", None, ""):
         try:
             os.mkdir("/mnt/home")
         except FileExistsError:
             common.eprint("/mnt/home exists when it shouldn't. We have issues...")
-        __mount__(settings["HOME"], "/mnt/home", ui)
+        __mount__(settings["HOME"], "/mnt/home", ui, mount_options)
     if settings["SWAP"] != "FILE":
         # This can happen in the background. No biggie.
         Popen(["swapon", settings["SWAP"]])
@@ -152,8 +294,6 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
     __update__(14)
     # STEP 3: Unsquash the sqaushfs and get the files where they need to go
     squashfs = ""
-    with open("/etc/edamame/settings.json", "r") as file:
-        config = json.loads(file.read())
     if not os.path.exists(config["squashfs_Location"]):
         common.eprint("\n    SQUASHFS FILE DOES NOT EXIST    \n")
         ui.error.show_error("\n\tSQUASHFS FILE DOES NOT EXIST\t\n")
@@ -181,44 +321,32 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
     except FileNotFoundError:
         pass
     common.eprint("    ###    EXTRACTING SQUASHFS    ###    ")
-    cmd = ["unsquashfs", config["squashfs_Location"]]
+    progress_channel.stage("Copying files")
+    flags = []
     # we're doing this as a tuple/list so that more can be added to this list later
     if auto_partitioner.get_fs(settings["ROOT"]) in ("ext2",):
-        cmd.append("-no-xattrs")
-    check_call(cmd)
+        flags.append("-no-xattrs")
+    # Spread extraction progress across 17% - 32%
+    unsquash.extract(config["squashfs_Location"], "/mnt", flags,
+                     callback=lambda percent: __update__(17 + round(percent * 0.15)))
     common.eprint("    ###    EXTRACTION COMPLETE    ###    ")
-    file_list = os.listdir("/mnt/squashfs-root")
-    for each in file_list:
-        try:
-            common.eprint("/mnt/squashfs-root/" + each + " --> /mnt/" + each)
-            shutil.move("/mnt/squashfs-root/" + each, "/mnt/" + each)
-        except shutil.Error as e:
-            common.eprint("ERROR: %s" % (e))
-    shutil.rmtree("/mnt/squashfs-root")
     try:
         os.mkdir("/mnt/boot")
     except FileExistsError:
         common.eprint("/mnt/boot already created")
-    shutil.copyfile("/tmp/edamame-progress.log",
-                    "/mnt/tmp/edamame-progress.log")
-    os.remove("/tmp/edamame-progress.log")
-    os.symlink("/mnt/tmp/edamame-progress.log",
-               "/tmp/edamame-progress.log")
     __update__(32)
     # STEP 4: Update fstab
+    progress_channel.stage("Generating fstab")
     common.eprint("    ###    Updating FSTAB    ###    ")
     os.remove("/mnt/etc/fstab")
     fstab_contents = check_output(["genfstab", "-U", "/mnt"]).decode()
+    # Don't keep the options used to speed up installation
+    fstab_contents = __set_fstab_options__(fstab_contents, mount_options)
     with open("/mnt/etc/fstab", "w+") as fstab:
         fstab.write(fstab_contents + "\n")
     __update__(34)
     # STEP 5: Extract Tar ball if needed, copy files to installation drive
     if not os.path.exists(local_repo):
-        common.eprint("EXTRACTING KERNEL.TAR.XZ")
-        tar_file = tar.open("/usr/share/edamame/kernel.tar.xz")
-        tar_file.extractall(path="/")
-        tar_file.close()
-        common.eprint("EXTRACTION COMPLETE")
         # try to use the default path. If an OSError or PermissionError is thrown,
         # default to a path that should be good. This may mean more memory usage
         # since /tmp is in memory, not on disk. But that's a sacrifice we can make here
@@ -227,17 +355,18 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
         except (OSError, PermissionError):
             local_repo = "/tmp/edamame/repo"
             common.recursive_mkdir(local_repo)
-        # Copy everything into local_repo at top level
-        # We COULD go ahead and copy everything where it needs to be, but that would
-        # make for more code and an extra check I don't wanna bother with right now
-        branches = os.listdir("/kernel")
-        for each in branches:
-            lv2 = os.listdir("/kernel/" + each)
-            for each1 in lv2:
-                shutil.move(f"/kernel/{each}/{each1}", f"{local_repo}/{each1}")
-    shutil.copytree(local_repo, "/mnt/repo")
+        common.eprint("EXTRACTING KERNEL.TAR.XZ")
+        __extract_kernel__(local_repo)
+        common.eprint("EXTRACTION COMPLETE")
+    __provide_repo__(local_repo)
+    settings["PACKAGE_CACHE"] = __provide_package_cache__(config.get("package_cache"))
+    settings["INITRAMFS_WORKERS"] = config.get("initramfs_workers", 0)
+    # Check once, out here, so everything in the chroot agrees, and doesn't
+    # read the installed system's settings.json to find out
+    settings["INTERNET"] = check_internet.has_internet()
     __update__(35)
     # STEP 6: Run Master script inside chroot
+    progress_channel.stage("Configuring installed system")
     # don't run it as a background process so we know when it gets done
     common.eprint("/mnt/etc/resolv.conf" + " --> " + "/mnt/etc/resolv.conf.save")
     shutil.move("/mnt/etc/resolv.conf", "/mnt/etc/resolv.conf.save")
@@ -263,6 +392,8 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
     real_root = chroot.arch_chroot("/mnt")
     modules.master.install(settings, config["distro"].replace(" ", "_"))
     chroot.de_chroot(real_root, "/mnt")
+    __remove_repo__()
+    __remove_package_cache__()
     common.eprint("Resetting resolv.conf")
     os.remove("/mnt/etc/resolv.conf")
     shutil.move("/mnt/etc/resolv.conf.save", "/mnt/etc/resolv.conf")
@@ -273,6 +404,7 @@ def install(settings: dict, local_repo: str, ui_type: str) -> None:
         file_list = []
     if ((len(file_list) == 0) and (settings["EFI"] not in (None, "", "NULL", False))):
         common.eprint("    ###    SYSTEMD-BOOT NOT CONFIGURED. CORRECTING . . .    ###    ")
+        progress_channel.stage("Configuring bootloader")
         check_call(["arch-chroot", "/mnt", "systemd-boot-manager", "-r"])
     try:
         shutil.rmtree(f"/mnt/home/{settings["USERNAME"]}/.config/xfce4/panel/launcher-3")
@@ -0,0 +1,76 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  log_tail.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Follow the end of a growing log file without re-reading all of it"""
+import collections
+import os
+
+
+class LogTail():
+    """Keep the last few lines of a log file
+
+    Only data appended since the last call to read() is read from disk.
+    If the file is truncated or replaced, reading starts over from the
+    beginning of the new file.
+    """
+    def __init__(self, path, lines=10):
+        self.path = path
+        self.lines = collections.deque(maxlen=lines)
+        self.offset = 0
+        self.inode = None
+        self.partial = ""
+
+    def read(self):
+        """Read anything new from the log
+
+        Returns True if the last lines changed, False otherwise.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.inode = stat.st_ino
+            self.offset = 0
+            self.partial = ""
+            self.lines.clear()
+        if stat.st_size == self.offset:
+            return False
+        with open(self.path, "rb") as file:
+            file.seek(self.offset)
+            data = file.read()
+        self.offset += len(data)
+        data = self.partial + data.decode(errors="replace")
+        data = data.split("\n")
+        # the last element is whatever follows the final newline
+        self.partial = data.pop()
+        self.lines.extend(data)
+        return len(data) > 0
+
+    def get_lines(self):
+        """Get the last lines of the log, including an unfinished last line"""
+        lines = list(self.lines)
+        if self.partial != "":
+            lines = lines[1:] if len(lines) == self.lines.maxlen else lines
+            lines.append(self.partial)
+        return lines
@@ -34,3 +34,8 @@ import modules.make_user as make_user
 import modules.purge as purge
 import modules.verify_install as verify_install
 import modules.common as common
+import modules.scheduler as scheduler
+import modules.transaction as transaction
+import modules.initramfs as initramfs
+import modules.local_repo as local_repo
+import modules.dpkg as dpkg
@@ -0,0 +1,247 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  dpkg.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Install .deb files from the local repo in as few dpkg runs as possible
+
+Also provides frontend_lock(), which takes dpkg's frontend lock the way
+apt does, so dpkg and apt runs in the chroot wait for each other
+instead of failing, and defer_triggers(), which holds back dpkg triggers
+and initramfs builds so they only run once, at the end.
+"""
+from __future__ import print_function
+from sys import stderr
+import contextlib
+import fcntl
+import os
+import subprocess as subproc
+import time
+import apt_pkg
+
+import modules.initramfs as initramfs
+
+
+LOCK = "/var/lib/dpkg/lock-frontend"
+UPDATE_INITRAMFS = "/usr/sbin/update-initramfs"
+INITRAMFS_PENDING = "/var/lib/edamame/update-initramfs.pending"
+POLICY_RC_D = "/usr/sbin/policy-rc.d"
+APT_CONF = "/etc/apt/apt.conf.d/99edamame-defer-triggers"
+APT_OPTIONS = {"DPkg::NoTriggers": "true",
+               "DPkg::ConfigurePending": "false",
+               "DPkg::TriggersPending": "false"}
+__deferred__ = {"depth": 0, "steps": [], "apt": {}}
+
+
+def eprint(*args, **kwargs):
+    """Make it easier for us to print to stderr"""
+    print(*args, file=stderr, **kwargs)
+
+
+@contextlib.contextmanager
+def frontend_lock(timeout=300):
+    """Hold dpkg's frontend lock, waiting up to timeout seconds for it
+
+    While it's held, dpkg and apt run by this process are told the lock
+    is already taken care of, through DPKG_FRONTEND_LOCKED.
+    """
+    os.makedirs(os.path.dirname(LOCK), exist_ok=True)
+    fd = os.open(LOCK, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o640)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Could not get {LOCK} after {timeout} seconds")
+                time.sleep(0.5)
+        previous = os.environ.get("DPKG_FRONTEND_LOCKED")
+        os.environ["DPKG_FRONTEND_LOCKED"] = "1"
+        try:
+            yield
+        finally:
+            if previous is None:
+                del os.environ["DPKG_FRONTEND_LOCKED"]
+            else:
+                os.environ["DPKG_FRONTEND_LOCKED"] = previous
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def __write_script__(path, body):
+    """Write an executable shell script to path"""
+    with open(path, "w") as file:
+        file.write("#!/bin/sh\n" + body)
+    os.chmod(path, 0o755)
+
+
+def __start_deferral__():
+    """Hold back triggers, update-initramfs, and service starts
+
+    Each change is noted in __deferred__["steps"] once it's been made,
+    so __end_deferral__() only undoes what was actually done. If a step
+    fails, the ones before it are undone before the error is raised.
+    """
+    __deferred__["steps"] = []
+    try:
+        # dpkg and apt-get skip triggers, and leave them pending
+        __deferred__["apt"] = {each: apt_pkg.config.find(each) for each in APT_OPTIONS}
+        __deferred__["steps"].append("apt")
+        for each in APT_OPTIONS:
+            apt_pkg.config.set(each, APT_OPTIONS[each])
+        with open(APT_CONF, "w") as file:
+            __deferred__["steps"].append("apt.conf")
+            for each in APT_OPTIONS:
+                file.write(f'{each} "{APT_OPTIONS[each]}";\n')
+        # Kernel hooks call update-initramfs directly. Send that to a stub
+        # that just notes an initramfs rebuild was asked for.
+        subproc.check_call(["dpkg-divert", "--quiet", "--local", "--rename",
+                            "--divert", UPDATE_INITRAMFS + ".edamame", "--add",
+                            UPDATE_INITRAMFS], stdout=stderr.buffer)
+        __deferred__["steps"].append("divert")
+        __write_script__(UPDATE_INITRAMFS,
+                         f"mkdir -p {os.path.dirname(INITRAMFS_PENDING)}\n"
+                         f"touch {INITRAMFS_PENDING}\n")
+        __deferred__["steps"].append("stub")
+        # Nothing should be started in the chroot anyways
+        if not os.path.exists(POLICY_RC_D):
+            __write_script__(POLICY_RC_D, "exit 101\n")
+            __deferred__["steps"].append("policy")
+    except BaseException:
+        __end_deferral__()
+        raise
+
+
+def __end_deferral__():
+    """Put back everything __start_deferral__() changed, newest first"""
+    steps = __deferred__["steps"]
+    while len(steps) > 0:
+        step = steps.pop()
+        if step == "policy":
+            os.remove(POLICY_RC_D)
+        elif step == "stub":
+            os.remove(UPDATE_INITRAMFS)
+        elif step == "divert":
+            subproc.check_call(["dpkg-divert", "--quiet", "--local", "--rename",
+                                "--remove", UPDATE_INITRAMFS], stdout=stderr.buffer)
+        elif step == "apt.conf":
+            os.remove(APT_CONF)
+        elif step == "apt":
+            for each in __deferred__["apt"]:
+                if __deferred__["apt"][each] == "":
+                    apt_pkg.config.clear(each)
+                else:
+                    apt_pkg.config.set(each, __deferred__["apt"][each])
+
+
+def triggers_deferred():
+    """Check if triggers are currently being deferred"""
+    return __deferred__["depth"] > 0
+
+
+def flush_triggers():
+    """Configure anything pending, running every trigger held back so far
+
+    Returns True if an initramfs rebuild was asked for while triggers
+    were deferred, and clears that request. It's up to the caller to
+    build them.
+    """
+    eprint("Running pending triggers...")
+    with frontend_lock():
+        subproc.check_call(["dpkg", "--configure", "--pending"],
+                           stdout=stderr.buffer)
+    try:
+        os.remove(INITRAMFS_PENDING)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def defer_triggers(workers=None):
+    """Defer dpkg triggers, and initramfs builds, until the end of the block
+
+    Triggers pile up while the block runs, and run once when it's done.
+    If update-initramfs was called in the meantime, any initramfs image
+    that's out of date is then built, with up to workers at a time.
+    Nesting this is fine; only the outermost block does anything.
+    """
+    if __deferred__["depth"] == 0:
+        __start_deferral__()
+    __deferred__["depth"] += 1
+    try:
+        yield
+    finally:
+        __deferred__["depth"] -= 1
+        if __deferred__["depth"] == 0:
+            try:
+                # Triggers run with update-initramfs still diverted, so
+                # initramfs-tools' trigger doesn't build anything
+                rebuild = flush_triggers()
+            finally:
+                __end_deferral__()
+            if rebuild:
+                initramfs.build(workers=workers)
+
+
+class Batch():
+    """Package files to install, and packages to purge, from one repo"""
+    def __init__(self, repo="/repo"):
+        self.repo = repo
+        self.files = []
+        self.purges = []
+
+    def install(self, files):
+        """Add package files in the repo to be installed"""
+        self.files += [each for each in files if each not in self.files]
+
+    def purge(self, packages):
+        """Add packages to be purged before anything is installed"""
+        self.purges += [each for each in packages if each not in self.purges]
+
+    def run(self):
+        """Purge, then install everything in one dpkg run
+
+        Returns True if anything was done, False if the batch was empty.
+        """
+        if len(self.files) == 0 and len(self.purges) == 0:
+            return False
+        if not os.path.exists("/var/run"):
+            os.mkdir("/var/run")
+        options = []
+        if triggers_deferred():
+            options.append("--no-triggers")
+        with frontend_lock():
+            if len(self.purges) > 0:
+                eprint("Purging: " + ", ".join(self.purges))
+                subproc.check_call(["dpkg", "-P", "--force-all"] + options + self.purges,
+                                   stdout=stderr.buffer)
+            if len(self.files) > 0:
+                eprint("Installing from local repo: " + ", ".join(self.files))
+                subproc.check_call(["dpkg", "--install", "--force-confnew"]
+                                   + options + self.files,
+                                   cwd=self.repo, stdout=stderr.buffer)
+        self.files = []
+        self.purges = []
+        return True
@@ -0,0 +1,110 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  initramfs.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Build initramfs images for installed kernels, in parallel"""
+from __future__ import print_function
+from sys import stderr
+import concurrent.futures as futures
+import os
+import subprocess as subproc
+import time
+
+
+BOOT = "/boot"
+MODULES = "/lib/modules"
+
+
+def eprint(*args, **kwargs):
+    """Make it easier for us to print to stderr"""
+    print(*args, file=stderr, **kwargs)
+
+
+def get_releases():
+    """Get the release of every kernel installed in /boot"""
+    releases = []
+    for each in sorted(os.listdir(BOOT)):
+        if each[:8] == "vmlinuz-" and not os.path.islink(f"{BOOT}/{each}"):
+            releases.append(each[8:])
+    return releases
+
+
+def __mtime__(path):
+    """Get the modification time of path, or 0 if it doesn't exist"""
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+def is_current(release):
+    """Check if the initramfs for release is newer than its kernel and modules"""
+    initrd = __mtime__(f"{BOOT}/initrd.img-{release}")
+    if initrd == 0:
+        return False
+    newest = max(__mtime__(f"{BOOT}/vmlinuz-{release}"),
+                 __mtime__(f"{MODULES}/{release}"),
+                 __mtime__(f"{MODULES}/{release}/modules.dep"))
+    return initrd > newest
+
+
+def __build__(release):
+    """Build the initramfs for one release, returning how long it took"""
+    start = time.monotonic()
+    eprint(f"Generating Initramfs for Kernel v{ release }")
+    subproc.check_call(["mkinitramfs", "-o", f"{BOOT}/initrd.img-{release}",
+                        release], stdout=stderr.buffer)
+    return time.monotonic() - start
+
+
+def build(releases=None, workers=None, force=False):
+    """Build initramfs images for releases, skipping any that are current
+
+    releases defaults to every kernel in /boot. Duplicates are only built
+    once. workers is how many images to build at once, defaulting to one
+    per CPU, up to 4. If force is True, current images are rebuilt too.
+
+    Returns a list of the releases that were built.
+    """
+    if releases is None:
+        releases = get_releases()
+    queue = []
+    for each in releases:
+        if each in queue:
+            continue
+        if is_current(each) and not force:
+            eprint(f"Initramfs for Kernel v{ each } is up to date. Skipping.")
+            continue
+        queue.append(each)
+    if len(queue) == 0:
+        return []
+    if workers in (None, 0):
+        workers = min(os.cpu_count() or 1, 4)
+    if not os.path.exists("/var/tmp"):
+        os.mkdir("/var/tmp")
+        os.chmod("/var/tmp", 0o777)
+    with futures.ThreadPoolExecutor(max_workers=min(workers, len(queue))) as pool:
+        jobs = {pool.submit(__build__, each): each for each in queue}
+        for each in futures.as_completed(jobs):
+            # Let a failure propagate, as a single mkinitramfs call would
+            eprint(f"Initramfs for Kernel v{ jobs[each] } built in {each.result():.2f} seconds")
+    return queue
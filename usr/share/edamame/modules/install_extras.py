@@ -30,7 +30,16 @@ import os
 import json
 import gzip
 
-import modules.purge as purge
+import modules.transaction as transaction
+import check_internet
+import hardware
+
+
+# Generated at build time from each driver's supported-gpus.json
+NVIDIA_INDEX = "/etc/edamame/nvidia.json"
+
+# Results of check_compat(), by driver version, then PCI device ID
+PROBE_CACHE = "/var/cache/edamame/nvidia-probes.json"
 
 
 # Make it easier for us to print to stderr
@@ -138,32 +147,81 @@ def check_compat(version_number: int, card: tuple) -> bool:
     return supported
 
 
-def cache_commit(cache):
-    """Run apt.cache.commit(), with error handling"""
+def get_nvidia_index() -> dict:
+    """Get the shipped NVIDIA driver index
+
+    Returns a dictionary with the following values:
+        drivers : list of driver versions the index covers
+        devices : dictionary mapping lower case PCI device IDs to the
+                  driver versions that support them
+
+    If the index is missing or unreadable, it covers no drivers.
+    """
     try:
-        cache.commit()
-    except apt.cache.LockFailedException:
-        try:
-            os.mkdir("/var/cache")
-        except FileExistsError:
-            pass
-        try:
-            os.mkdir("/var/cache/apt")
-        except FileExistsError:
-            pass
-        try:
-            os.mkdir("/var/cache/apt/archives")
-        except FileExistsError:
-            pass
-        with open("/var/cache/apt/archives/lock", "w+") as file:
-            file.write("")
-        os.chmod("/var/cache/apt/archives/lock", 0o640)
-        os.chown("/var/cache/apt/archives/lock", 0, 0)
-        cache.commit()
-
-
-def determine_driver(card: tuple) -> int:
-    """Determine which Nvidia driver is needed for a given card."""
+        with open(NVIDIA_INDEX, "r") as file:
+            index = json.load(file)
+        return {"drivers": index["drivers"], "devices": index["devices"]}
+    except (FileNotFoundError, json.decoder.JSONDecodeError, KeyError):
+        return {"drivers": [], "devices": {}}
+
+
+def __read_probes__() -> dict:
+    """Get check_compat() results saved by earlier runs"""
+    try:
+        with open(PROBE_CACHE, "r") as file:
+            probes = json.load(file)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+    if not isinstance(probes, dict):
+        return {}
+    return probes
+
+
+def __save_probe__(version_number: int, devid: str, supported: bool) -> None:
+    """Save a check_compat() result for later runs"""
+    probes = __read_probes__()
+    probes.setdefault(str(version_number), {})[devid] = supported
+    try:
+        os.makedirs(os.path.dirname(PROBE_CACHE), exist_ok=True)
+        with open(PROBE_CACHE + ".part", "w") as file:
+            json.dump(probes, file, indent=1)
+        os.replace(PROBE_CACHE + ".part", PROBE_CACHE)
+    except OSError as error:
+        __eprint__(f"Could not save NVIDIA driver probe results: {error}")
+
+
+def is_supported(version_number: int, card: tuple, index: dict,
+                 internet: bool = None) -> bool:
+    """Check if a driver supports a card
+
+    Uses the shipped index if it covers this driver, otherwise falls back
+    to downloading the driver with check_compat(). Those results are
+    saved in PROBE_CACHE, so each driver is only ever downloaded once per
+    card.
+
+    internet is whether we're online. If None, it is checked here.
+    """
+    devid = card[0].lower()
+    if version_number in index["drivers"]:
+        return version_number in index["devices"].get(devid, [])
+    probes = __read_probes__().get(str(version_number), {})
+    if devid in probes:
+        return probes[devid]
+    __eprint__(f"nvidia-driver-{version_number} not in driver index. Checking it manually...")
+    supported = check_compat(version_number, card)
+    # check_compat() also says False when it couldn't download the
+    # driver, so only trust that if we're online
+    if (not supported) and (internet is None):
+        internet = check_internet.has_internet()
+    if supported or internet:
+        __save_probe__(version_number, devid, supported)
+    return supported
+
+
+def determine_driver(card: tuple, internet: bool = None) -> int:
+    """Determine which Nvidia driver is needed for a given card.
+
+    internet is passed on to is_supported()."""
     # Get Nvidia drivers available in apt
     packages = subproc.check_output(["apt-cache", "search", "^nvidia-driver-"]).decode()
     packages = packages.split("\n")
@@ -191,8 +249,9 @@ def determine_driver(card: tuple) -> int:
     packages.sort(reverse=True)
 
     # Check for compatability
+    index = get_nvidia_index()
     for each in packages:
-        if check_compat(each, card):
+        if is_supported(each, card, index, internet):
             return each
     # Nothing is compatable. Return None.
     return None
@@ -200,77 +259,76 @@ def determine_driver(card: tuple) -> int:
 
 def detect_nvidia() -> tuple:
     """Detect what NVIDIA card is in use"""
-    try:
-        pci = subproc.check_output("lspci -qnnmm | grep -i 'nvidia' | grep -E 'VGA|3D'", shell=True).decode().split('\n')
-    except subproc.CalledProcessError:
+    cards = hardware.get_devices(vendor=hardware.NVIDIA,
+                                 base_class=hardware.DISPLAY)
+    if len(cards) == 0:
         return None
-    pci = pci[0]
-    pci = pci.split('" "')[2]
-    card_name = pci[list(pci).index('[') + 1:list(pci).index(']')]
-    pci = pci.split(f"[{card_name}] ")[1]
-    pci = pci[list(pci).index('[') + 1:list(pci).index(']')]
+    # pci.ids names look like "GA104 [GeForce RTX 3070]"
+    card_name = cards[0]["device_name"]
+    if "[" in card_name and "]" in card_name:
+        card_name = card_name[card_name.index("[") + 1:card_name.index("]")]
     if "Rev." in card_name:
         index = card_name.split().index("Rev.")
         card_name = " ".join(card_name.split()[:index])
-    return (pci, card_name)
+    return (f"{cards[0]['device']:04x}", card_name)
 
 
 def detect_realtek():
     """Detect what Realtek card is in use"""
-    try:
-        pci = subproc.check_output("lspci -qmm | grep -i 'realtek'", shell=True).decode().split('\n')[0]
-    except subproc.CalledProcessError:
+    cards = hardware.get_devices(vendor=hardware.REALTEK)
+    if len(cards) == 0:
         return None
-    toggle = False
-    start = 0
-    count = 2
-    device = None
-    for each in enumerate(pci):
-        if (not toggle) and (each[1] == '"'):
-            toggle = True
-            start = each[0]
-        elif (toggle) and (each[1] == '"'):
-            toggle = False
-            if count == 0:
-               device = pci[start + 1:each[0]].split(" ")[0].lower()
-               break
-            else:
-                count -= 1
-    return device
+    return cards[0]["device_name"].split(" ")[0].lower()
+
 
+def install_extras(session=None, internet=None):
+    """Install Restrcted Extras from apt
 
-def install_extras():
-    """Install Restrcted Extras from apt"""
+    If `session' is a transaction.Transaction, packages are only marked,
+    and committed along with everything else in that session. Otherwise,
+    they are committed before returning.
+
+    internet is whether we're online, as checked by the installer. If
+    None, it is checked here.
+    """
     __eprint__("\t\t\t###    install_extras.py STARTED    ###    ")
-    # Make sure our cache is up to date and open
-    cache = apt.cache.Cache()
-    try:
-        cache.update()
-    except apt.cache.FetchFailedException:
-        subproc.check_call(["apt-get", "update"])
-    cache.open()
+    if internet is None:
+        internet = check_internet.has_internet()
+    if not internet:
+        __eprint__("\t\t\t### WARNING ###")
+        __eprint__("NO INTERNET CONNECTION. SKIPPING RESTRICTED EXTRAS.")
+        return
+    # Make sure our cache is up to date and open. If the session is already
+    # open, the package lists were updated when it was.
+    own_session = session is None
+    if own_session:
+        session = transaction.Transaction()
+    cache = session.open(update=True)
     NVIDIA = False
     # Check PCI list
-    pci = subproc.check_output(["lspci", "-q"]).decode()
+    broadcom = " ".join(each["device_name"] for each in
+                        hardware.get_devices(vendor=hardware.BROADCOM))
     # Install list, append extra stuff to this
     standard_install_list = ["ubuntu-restricted-extras", "ubuntu-restricted-addons"]
     additional_install_list = []
     # Broadcom wifi cards (my condolences to all users of these infernal things)
-    if "broadcom" in pci.lower():
+    if broadcom != "":
         # Newer cards take different drivers from older cards
+        newer = False
         for each in ("BCM43142", "BCM4331", "BCM4360", "BCM4352"):
-            if each in pci:
+            if each in broadcom:
                 additional_install_list = additional_install_list + ["broadcom-sta-dkms", "dkms",
                                                "wireless-tools"]
+                newer = True
                 break
-        if len(additional_install_list) == 2:
+        if not newer:
             for each in ("BCM4311", "BCM4312", "BCM4313", "BCM4321", "BCM4322",
                          "BCM43224", "BCM43225", "BCM43227", "BCM43228"):
-                if each in pci:
+                if each in broadcom:
                     additional_install_list.append("bcmwl-kernel-source")
                     break
     # Realtek cards. Not as bad as Broadcom, but still suck
-    if "realtek" in pci.lower():
+    if len(hardware.get_devices(vendor=hardware.REALTEK)) > 0:
         with open("/etc/edamame/realtek.json", "r") as file:
             drivers = json.load(file)
         device = detect_realtek()
@@ -282,10 +340,10 @@ def install_extras():
             __eprint__(f"NO REALTEK DRIVER FOUND FOR DEVICE: {device}")
             __eprint__("IT IS LIKELY THAT ANY DRIVERS NEEDED ARE BUILT INTO THE KERNEL.")
     # Nvidia graphics cards
-    if "nvidia" in pci.lower():
+    nvidia_card = detect_nvidia()
+    if nvidia_card is not None:
         # Figure our what driver we need
-        nvidia_card = detect_nvidia()
-        needed_driver = determine_driver(nvidia_card)
+        needed_driver = determine_driver(nvidia_card, internet)
         latest_deps_raw = subproc.check_output(["apt-cache", "depends", "nvidia-driver-latest"]).decode().split('\n')[1:]
         latest_deps_raw = [each for each in latest_deps_raw if each != ""]
         latest_deps = [each.split(": ")[1] for each in latest_deps_raw]
@@ -314,34 +372,22 @@ def install_extras():
     os.environ["DEBIAN_FRONTEND"] = "noninteractive"
     try:
         __eprint__("Attempting to install standard restricted extra packages...")
-        with cache.actiongroup():
-            for each in standard_install_list:
-                __eprint__(f"Installing `{each}'...")
-                cache[each].mark_install()
-        cache_commit(cache)
-    except (apt.cache.FetchFailedException, apt.cache.LockFailedException, apt.apt_pkg.Error):
-        try:
-            subproc.check_call(["apt-get", "--force-yes", "-y", "install"] + standard_install_list)
-        except subproc.CalledProcessError:
-            __eprint__("\t\t\t### WARNING ###")
-            __eprint__("INSTALLATION OF STANDARD RESTRICTED EXTRAS FAILED. CONTINUING TO DRIVERS...")
+        session.install(standard_install_list)
+    except (KeyError, apt.apt_pkg.Error):
+        __eprint__("\t\t\t### WARNING ###")
+        __eprint__("INSTALLATION OF STANDARD RESTRICTED EXTRAS FAILED. CONTINUING TO DRIVERS...")
     try:
         if len(additional_install_list) > 0:
             __eprint__("Attempting to install restricted driver packages...")
-            with cache.actiongroup():
-                for each in additional_install_list:
-                    __eprint__(f"Installing `{each}'...")
-                    cache[each].mark_install()
-            cache_commit(cache)
-    except (apt.cache.FetchFailedException, apt.cache.LockFailedException, apt.apt_pkg.Error):
-        try:
-            subproc.check_call(["apt-get", "--force-yes", "-y", "install"] + additional_install_list)
-        except subproc.CalledProcessError:
-            __eprint__("\t\t\t### WARNING ###")
-            __eprint__("INSTALLATION OF DRIVERS FAILED.")
+            session.install(additional_install_list)
+    except (KeyError, apt.apt_pkg.Error):
+        __eprint__("\t\t\t### WARNING ###")
+        __eprint__("INSTALLATION OF DRIVERS FAILED.")
     # Purge all the stuff we don't want
 
     __eprint__(f"Attempting to remove `gstreamer1.0-fluendo-mp3' if present, for better MP3 audio quality...")
-    purge.purge_package("gstreamer1.0-fluendo-mp3")
-    cache.close()
+    session.remove("gstreamer1.0-fluendo-mp3")
+    if own_session:
+        session.commit()
+        session.report()
     __eprint__("\t\t\t###    install_extras.py CLOSED    ###    ")
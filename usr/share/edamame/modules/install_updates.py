@@ -24,11 +24,10 @@
 """Install system updates from apt"""
 from __future__ import print_function
 from sys import stderr
-import os
 import apt
 import subprocess as subproc
 
-import modules.purge as purge
+import modules.transaction as transaction
 
 
 # Make it easier for us to print to stderr
@@ -45,48 +44,27 @@ def update_flatpak():
     subproc.check_call(["flatpak", "--system", "update", "-y"])
 
 
-def cache_commit(cache):
-    """Run apt.cache.commit(), with error handling"""
-    try:
-        cache.commit()
-    except apt.cache.LockFailedException:
-        try:
-            os.mkdir("/var/cache")
-        except FileExistsError:
-            pass
-        try:
-            os.mkdir("/var/cache/apt")
-        except FileExistsError:
-            pass
-        try:
-            os.mkdir("/var/cache/apt/archives")
-        except FileExistsError:
-            pass
-        with open("/var/cache/apt/archives/lock", "w+") as file:
-            file.write("")
-        os.chmod("/var/cache/apt/archives/lock", 0o640)
-        os.chown("/var/cache/apt/archives/lock", 0, 0)
-        cache.commit()
-
+def update_system(session=None):
+    """update system through package manager
 
-def update_system():
-    """update system through package manager"""
+    If `session' is a transaction.Transaction, the upgrade is only marked,
+    and committed along with everything else in that session. Otherwise,
+    it is committed before returning.
+    """
     __eprint__("\t\t\t###    install_updates.py STARTED    ###    ")
-    cache = apt.cache.Cache()
-    try:
-        cache.update()
-    except apt.cache.FetchFailedException:
-        subproc.check_call(["apt-get", "update"])
-    cache.open()
+    own_session = session is None
+    if own_session:
+        session = transaction.Transaction()
+    session.open(update=True)
     try:
-        cache.upgrade()
-        cache_commit(cache)
-    except (apt.cache.FetchFailedException, apt.cache.LockFailedException, apt.apt_pkg.Error):
-            try:
-                subproc.check_call(["apt-get", "--force-yes", "-y", "upgrade"])
-            except subproc.CalledProcessError:
-                print("ERROR: Possible held packages. Update may be partially completed.")
-    purge.autoremove(cache)
-    cache.close()
+        session.upgrade()
+    except apt.apt_pkg.Error:
+        print("ERROR: Possible held packages. Update may be partially completed.")
+    # Download upgrades while flatpaks and extras are dealt with
+    session.prefetch(background=True)
+    if own_session:
+        session.autoremove()
+        session.commit()
+        session.report()
     update_flatpak()
     __eprint__("\t\t\t###    install_updates.py CLOSED    ###    ")
@@ -0,0 +1,159 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  local_repo.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Index the offline package repo and resolve install sets from it
+
+Each .deb's control data is read once. Dependencies are then resolved
+by package name and version constraint, rather than by matching
+substrings of file names.
+"""
+from __future__ import print_function
+from sys import stderr
+import functools
+import os
+import apt_inst
+import apt_pkg
+
+
+__cache__ = {}
+
+
+def __eprint__(*args, **kwargs):
+    """Make it easier for us to print to stderr"""
+    print(*args, file=stderr, **kwargs)
+
+
+def read_control(path):
+    """Read the fields we need from a .deb's control data
+
+    Returns a dictionary with the following values:
+        file : file name of the package, without its directory
+        package : package name
+        version : package version
+        depends : list of or-groups, each a list of (name, version, op)
+        provides : list of (name, version, op)
+    """
+    control = apt_pkg.TagSection(apt_inst.DebFile(path).control.extractdata("control"))
+    depends = []
+    for field in ("Pre-Depends", "Depends"):
+        if field in control:
+            depends += apt_pkg.parse_depends(control[field])
+    provides = []
+    if "Provides" in control:
+        provides = [each[0] for each in apt_pkg.parse_depends(control["Provides"])]
+    return {"file": os.path.basename(path),
+            "package": control["Package"],
+            "version": control["Version"],
+            "depends": depends,
+            "provides": provides}
+
+
+def get_index(repo="/repo"):
+    """Index every package in repo by name, and by what it provides
+
+    Returns a dictionary mapping names to lists of read_control()
+    results, highest version first. The index is rebuilt only if the
+    repo changes.
+    """
+    apt_pkg.init_system()
+    mtime = os.stat(repo).st_mtime
+    if repo in __cache__ and __cache__[repo][0] == mtime:
+        return __cache__[repo][1]
+    index = {}
+    for each in sorted(os.listdir(repo)):
+        if each[-4:] != ".deb":
+            continue
+        try:
+            package = read_control(f"{repo}/{each}")
+        except (SystemError, LookupError) as error:
+            __eprint__(f"Could not read {each}: {error}")
+            continue
+        index.setdefault(package["package"], []).append(package)
+        for provided in package["provides"]:
+            if provided[0] != package["package"]:
+                index.setdefault(provided[0], []).append(package)
+    version_key = functools.cmp_to_key(apt_pkg.version_compare)
+    for each in index.values():
+        each.sort(key=lambda package: version_key(package["version"]), reverse=True)
+    __cache__[repo] = (mtime, index)
+    return index
+
+
+def __satisfies__(package, name, version, op):
+    """Check if package satisfies the dependency (name, version, op)"""
+    if package["package"] == name:
+        return apt_pkg.check_dep(package["version"], op, version)
+    for provided in package["provides"]:
+        if provided[0] == name:
+            # Unversioned provides can only satisfy unversioned dependencies
+            if version == "":
+                return True
+            return provided[1] != "" and apt_pkg.check_dep(provided[1], op, version)
+    return False
+
+
+def resolve(roots, index, installed):
+    """Work out the minimal set of packages to install from the repo
+
+    roots : names of the packages we want installed
+    index : result of get_index()
+    installed : dictionary of installed package names to versions
+
+    Every root is included. A dependency is only pulled from the repo if
+    nothing installed or already chosen satisfies it.
+
+    Returns a list of file names, dependencies before what needs them.
+    """
+    chosen = {}
+    order = []
+
+    def satisfied(name, version, op):
+        if name in installed and apt_pkg.check_dep(installed[name], op, version):
+            return True
+        return any(__satisfies__(each, name, version, op) for each in chosen.values())
+
+    def choose(package):
+        chosen[package["package"]] = package
+        for group in package["depends"]:
+            if any(satisfied(*each) for each in group):
+                continue
+            for name, version, op in group:
+                candidates = [each for each in index.get(name, [])
+                              if each["package"] not in chosen and
+                              __satisfies__(each, name, version, op)]
+                if len(candidates) > 0:
+                    choose(candidates[0])
+                    break
+            else:
+                __eprint__(f"WARNING: {package['package']}: nothing in the local repo satisfies: " +
+                           " | ".join(f"{each[0]} {each[2]} {each[1]}".strip() for each in group))
+        order.append(package["file"])
+
+    for each in roots:
+        if each in chosen:
+            continue
+        if each not in index:
+            __eprint__(f"WARNING: {each} not found in local repo")
+            continue
+        choose(index[each][0])
+    return order
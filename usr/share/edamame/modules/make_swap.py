@@ -25,55 +25,102 @@
 from __future__ import print_function
 from sys import stderr
 import subprocess
-from os import chmod
+import os
 from time import sleep
 from psutil import virtual_memory
 
+SWAPFILE = "/.swapfile"
+CHUNK = 1024 ** 2
+
+
 def eprint(*args, **kwargs):
     """Make it easier for us to print to stderr"""
     print(*args, file=stderr, **kwargs)
 
 
+def get_swap_size():
+    """Get ideal swap file size, in bytes, for the current system's RAM
+
+    This is rounded up to the nearest MiB.
+    """
+    mem = virtual_memory().total
+    swap = round((mem + ((mem / 1024 ** 3) ** 0.5) * 1024 ** 3))
+    return -(-swap // CHUNK) * CHUNK
+
+
+def get_fs_type(path):
+    """Get the filesystem type of the filesystem `path' is on"""
+    try:
+        return subprocess.check_output(["findmnt", "--noheadings",
+                                        "--output", "FSTYPE", "--target",
+                                        path]).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return ""
+
+
+def __btrfs_mkswapfile__(size):
+    """Have btrfs-progs make the swap file. Returns True on success.
+
+    This handles NOCOW, compression and preallocation for us, and runs
+    mkswap on the result.
+    """
+    try:
+        subprocess.check_call(["btrfs", "filesystem", "mkswapfile", "--size",
+                               f"{size // CHUNK}m", SWAPFILE],
+                              stdout=stderr.buffer, stderr=stderr.buffer)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        # btrfs-progs older than 6.1 doesn't have mkswapfile
+        if os.path.exists(SWAPFILE):
+            os.remove(SWAPFILE)
+        return False
+    return True
+
+
+def __write_zeros__(swapfile, size):
+    """Fill `swapfile' with `size' bytes of zeros
+
+    Only used when the filesystem can't preallocate for us.
+    """
+    zeros = bytes(CHUNK)
+    written = 0
+    perc = 5
+    while written < size:
+        written += os.write(swapfile, zeros[:min(CHUNK, size - written)])
+        current = (written * 100) // size
+        if current >= perc:
+            eprint(f"SWAP FILE { current }% complete ({ written // CHUNK } MiB)")
+            perc = current - (current % 5) + 5
+    os.fsync(swapfile)
+
+
 def make_swap():
     """Make swap File"""
     eprint("    ###    make_swap.py STARTED    ###    ")
-    mem = virtual_memory()
-    # get data we need to get total system memory
-    swap = mem.total
-    # you would think more threads would make it use more
-    # CPU time and write faster but testing suggests otherwise
-    # testing says once you hit the same number of threads
-    # the CPU has, there's no more you can get
-    swap = round((swap + ((swap / 1024 ** 3) ** 0.5) * 1024 ** 3))
-    # you would think having a larger string would help,
-    # but past a certain point it does not
-    multiplyer = 10000
-    load_balancer = 3
-    master_string = "\0" * multiplyer
-    swap = round(swap / multiplyer)
-    loop_count = round(swap / (multiplyer * load_balancer))
-    print_point = round(loop_count / 20)
-    perc = 5
-    with open("/.swapfile", "w+") as swapfile:
-        swapfile.write("")
-        swapfile.flush()
+    size = get_swap_size()
+    fs_type = get_fs_type("/")
+    eprint(f"Making { size // CHUNK } MiB swap file on { fs_type }")
+    if fs_type == "btrfs" and __btrfs_mkswapfile__(size):
+        eprint("Swap file made with `btrfs filesystem mkswapfile'")
+    else:
+        swapfile = os.open(SWAPFILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
         try:
-            subprocess.check_call(["chattr", "+C", "/.swapfile"])
-        except subprocess.CalledProcessError:
-            # if this happens, we likely are not using a btrfs file system
-            # ignore
-            pass
-        for i in range(loop_count):
-            swapfile.write(master_string * (multiplyer * load_balancer))
-            swapfile.flush()
-            if (i % print_point) == 0:
-                if perc <= 100:
-                    eprint(f"SWAP FILE { perc }% complete")
-                    perc += 5
-    chmod("/.swapfile", 0o600)
-    subprocess.check_call(["mkswap", "/.swapfile"], stdout=stderr.buffer)
+            if fs_type == "btrfs":
+                # NOCOW has to be set while the file is still empty
+                try:
+                    subprocess.check_call(["chattr", "+C", SWAPFILE])
+                except subprocess.CalledProcessError:
+                    eprint("WARNING: Could not disable CoW on swap file")
+            try:
+                os.posix_fallocate(swapfile, 0, size)
+            except OSError:
+                eprint("Filesystem does not support fallocate. Writing zeros instead...")
+                __write_zeros__(swapfile, size)
+        finally:
+            os.close(swapfile)
+        os.chmod(SWAPFILE, 0o600)
+        subprocess.check_call(["mkswap", SWAPFILE], stdout=stderr.buffer)
     sleep(0.1)
-    subprocess.Popen(["swapon", "/.swapfile"])
+    subprocess.Popen(["swapon", SWAPFILE])
     eprint("    ###    make_swap.py CLOSED    ###    ")
 
 if __name__ == '__main__':
@@ -27,7 +27,6 @@ Configure newly installed system from within a chroot
 from __future__ import print_function
 from sys import argv, stderr
 import subprocess as subproc
-import multiprocessing
 import os
 from shutil import rmtree, copyfile
 from inspect import getfullargspec
@@ -37,6 +36,8 @@ import warnings
 import tarfile as tar
 import traceback
 import de_control.modify as de_modify
+import progress_channel
+import check_kernel_versions
 
 
 # import our own programs
@@ -47,8 +48,13 @@ import modules.set_locale as set_locale
 import modules.install_updates as install_updates
 import modules.make_user as mkuser
 import modules.install_extras as install_extras
+import modules.transaction as transaction
+import modules.initramfs as initramfs
+import modules.local_repo as local_repo
+import modules.dpkg as dpkg
 from modules.verify_install import verify
 from modules.purge import purge_package
+import modules.scheduler as scheduler
 
 
 def eprint(*args, **kwargs):
@@ -57,91 +63,55 @@ def eprint(*args, **kwargs):
 
 
 def __update__(percentage):
-    try:
-        with open("/tmp/edamame-progress.log", "w+") as progress:
-            progress.write(str(percentage))
-    except PermissionError:
-        os.chmod("/tmp/edamame-progress.log", 0o666)
-        with open("/tmp/edamame-progress.log", "w+") as progress:
-            progress.write(str(percentage))
+    progress_channel.percent(percentage)
+
+
+# What each task in MainInstallation needs finished before it can start,
+# and roughly how expensive it is. Tasks not listed here have no
+# dependencies and a weight of 1.
+#
+# apt waits on make_user because make_user rewrites /etc/passwd by hand,
+# without taking the shadow lock, while package maintainer scripts add
+# system users with adduser/useradd. Run together, one of them can write
+# back a stale copy and lose the other's accounts. make_user is short, so
+# apt still starts near the beginning.
+TASKS = {
+    "apt": {"depends": ["make_user"], "weight": 10},
+    "mk_swap": {"depends": [], "weight": 8},
+    "make_user": {"depends": [], "weight": 3},
+    "locale_set": {"depends": [], "weight": 2},
+    "set_passwd": {"depends": ["make_user"], "weight": 1},
+    "lightdm_config": {"depends": ["make_user"], "weight": 1},
+    "remove_launcher": {"depends": ["make_user"], "weight": 1},
+}
 
 
 class MainInstallation():
     """Main Installation Procedure, minus low-level stuff"""
     def __init__(self, processes_to_do, settings):
-        # for each1 in processes_to_do:
-        #     process_new = getattr(MainInstallation, each1, self)
-        #     args_list = getfullargspec(process_new)[0]
-        #     args = []
-        #     for each in args_list:
-        #         args.append(settings[each])
-        #     globals()[each1] = multiprocessing.Process(target=process_new,
-        #                                                args=args)
-        #     globals()[each1].start()
         offset = 39
         ending = 51
         iterator = round(ending / len(processes_to_do))
-        # We COULD set point equal to iterator, but we don't want the iterator
-        # to change, so re-doing the math is safer, albiet slower.
-        point = round(ending / len(processes_to_do))
-        # while len(processes_to_do) > 0:
-        #     for each in range(len(processes_to_do) - 1, -1, -1):
-        #         if not globals()[processes_to_do[each]].is_alive():
-        #             globals()[processes_to_do[each]].join()
-        #             del processes_to_do[each]
-        #             __update__(point + offset)
-        #             point += iterator
-
-        """
-        NEW PROCESS SPAWNER!!!
-
-        This new spawner is designed to scale with how many cores a given CPU has, so we don't over extend our resources
-        """
-        working = {}
-        while len(processes_to_do) > 0:
-            # First, check if we have any processes that are completed that we need to close
-            to_del = []
-            for each in working:
-                if not working[each].is_alive():
-                    # We have a process to clean up
-                    working[each].join()
-                    del processes_to_do[processes_to_do.index(each)]
-                    to_del.append(each)
-                    __update__(point + offset)
-                    point += iterator
-            for each in to_del:
-                del working[each]
-            # Second, check how many processes we have running against how many cores we have
-            if len(working) < os.cpu_count():
-                # We have fewer processes than CPUs.
-                if len(processes_to_do) > len(working):
-                    """
-                        Processes that are spawned remain in the "to-do" list until done.
-                        So, the to-do list is always greater than or equal in length to the list of currently running processes
-                    """
-                    new = None
-                    for each in processes_to_do:
-                        if each not in working.keys():
-                            new = each
-                            break
-                    if new is None:
-                        continue
-                    process_new = getattr(MainInstallation, new, self)
-                    args_list = getfullargspec(process_new)[0]
-                    args = []
-                    for each in args_list:
-                        args.append(settings[each])
-                    working[new] = multiprocessing.Process(target=process_new, args=args)
-                    working[new].start()
-                else:
-                    # We don't want to sit and spin and waste CPU time. Just sleep...
-                    sleep(0.1)
-            else:
-                # We don't want to sit and spin and waste CPU time. Just sleep...
-                sleep(0.1)
-            # This line is temporary, for debugging purposes.
-            # eprint(f"Running Processes: {len(working)}\nProcesses to do: {len(processes_to_do) - len(working)}")
-
+        point = iterator
+
+        def finished(name):
+            nonlocal point
+            eprint(f"Finished: {name}")
+            __update__(point + offset)
+            point += iterator
+
+        tasks = {}
+        for each in processes_to_do:
+            process_new = getattr(MainInstallation, each, self)
+            args_list = getfullargspec(process_new)[0]
+            tasks[each] = {"target": process_new,
+                           "args": [settings[each1] for each1 in args_list],
+                           "depends": TASKS.get(each, {}).get("depends", []),
+                           "weight": TASKS.get(each, {}).get("weight", 1)}
+        timing = scheduler.run(tasks, callback=finished)
+        eprint("TASK TIMING:")
+        for each in sorted(timing, key=timing.get, reverse=True):
+            eprint(f"\t{each}: {timing[each]:.2f} seconds")
 
     def time_set(TIME_ZONE):
         """Set system time"""
@@ -183,18 +153,17 @@ class MainInstallation():
             except IOError:
                 eprint("Adding swap failed. Must manually add later")
 
-    def apt(UPDATES, EXTRAS):
+    def apt(UPDATES, EXTRAS, PACKAGE_CACHE, INTERNET):
         """Run commands for apt sequentially to avoid front-end lock"""
-        # MainInstallation.__install_updates__(UPDATES, INTERNET)
-        # There should be nothing running that is updating the CHROOT, kill the lock
-        if os.path.exists("/var/cache/apt/archives/lock"):
-            os.remove("/var/cache/apt/archives/lock")
-        if os.path.exists("/var/lib/apt/lists/lock"):
-            os.remove("/var/lib/apt/lists/lock")
+        session = transaction.Transaction(PACKAGE_CACHE)
         if UPDATES:
-            install_updates.update_system()
+            install_updates.update_system(session)
         if EXTRAS:
-            install_extras.install_extras()
+            install_extras.install_extras(session, INTERNET)
+        if UPDATES or EXTRAS:
+            session.autoremove()
+            session.commit()
+            session.report()
 
     def set_passwd(USERNAME, PASSWORD):
         """Set password for Root and User"""
@@ -296,20 +265,56 @@ def set_plymouth_theme():
         process.communicate(input=bytes("2\n", "utf-8"))
 
 
-def install_kernel(release):
-    """Install kernel from kernel.tar.xz"""
+def get_installed_versions(packages=()):
+    """Get the installed version of each package, leaving out any not installed
+
+    If no packages are given, get every installed package.
+    """
+    output = subproc.run(["dpkg-query", "--show",
+                          "--showformat=${Package} ${Version} ${db:Status-Abbrev}\n"]
+                         + list(packages), stdout=subproc.PIPE, stderr=subproc.DEVNULL)
+    versions = {}
+    for each in output.stdout.decode().split("\n"):
+        each = each.split(" ")
+        if len(each) > 2 and each[2] == "ii":
+            versions[each[0]] = each[1]
+    return versions
+
+
+def install_kernel(release, batch=None):
+    """Install kernel from kernel.tar.xz
+
+    Only packages whose installed version differs from the one in the
+    local repo are reinstalled.
+
+    If batch is a dpkg.Batch, the packages are only added to it, to be
+    installed when it runs. Otherwise, they are installed right away.
+    """
     # we are going to do offline kernel installation from now on.
     # it's just easier and more reliable
-    packages = ["linux-headers-" + release, "linux-image-" + release]
-    install_command = ["dpkg", "--install", "--force-confnew"]
-    if not os.path.exists("/var/run"):
-        os.mkdir("/var/run")
-    subproc.check_call(["dpkg", "-P", "--force-all"] + packages,
-                       stdout=stderr.buffer)
-    packages = [each for each in os.listdir("/repo") if "linux-" in each]
-    os.chdir("/repo")
-    subproc.check_call(install_command + packages, stdout=stderr.buffer)
-    os.chdir("/")
+    manifest = check_kernel_versions.get_manifest("/repo")
+    packages = [each for each in manifest["packages"] if "linux-" in each["file"]]
+    installed = get_installed_versions([each["package"] for each in packages])
+    packages = [each for each in packages
+                if installed.get(each["package"]) != each["version"]]
+    if len(packages) == 0:
+        eprint("Kernel packages in local repo already installed. Skipping reinstallation.")
+        return
+    eprint("Reinstalling kernel packages: " + ", ".join(each["package"] for each in packages))
+    own_batch = batch is None
+    if own_batch:
+        batch = dpkg.Batch("/repo")
+    batch.purge([each["package"] for each in packages
+                 if each["package"] in ("linux-headers-" + release, "linux-image-" + release)
+                 and each["package"] in installed])
+    batch.install([each["file"] for each in packages])
+    if own_batch:
+        batch.run()
+        autopurge()
+
+
+def autopurge():
+    """Clean up packages left behind by kernel installation"""
     try:
         subproc.check_call(["apt-get", "autopurge", "-y"],
                            stdout=stderr.buffer)
@@ -317,12 +322,17 @@ def install_kernel(release):
         eprint("WARNING: Clean up post-kernel install failed. This will likely be fixed later.")
 
 
-def install_bootloader(efi, root, release, distro, compat_mode, upgraded=False):
+def install_bootloader(efi, root, release, distro, compat_mode, upgraded=False,
+                       installed=False):
     """Determine whether bootloader needs to be systemd-boot (for UEFI)
     or GRUB (for BIOS)
-    and install the correct one."""
+    and install the correct one.
+
+    installed should be True if systemd-boot's packages were already
+    installed by setup_lowlevel()."""
     if efi not in ("NULL", None, "", False):
-        _install_systemd_boot(release, root, distro, compat_mode, upgraded)
+        _install_systemd_boot(release, root, distro, compat_mode, upgraded,
+                              installed)
     else:
         _install_grub(root)
 
@@ -361,23 +371,42 @@ def _install_grub(root):
                           stdout=stderr.buffer)
 
 
-def _install_systemd_boot(release, root, distro, compat_mode, upgraded):
-    """set up and install systemd-boot"""
+def get_systemd_boot_packages(upgraded):
+    """Work out what to install for systemd-boot, systemd-boot-manager, and efibootmgr
+
+    upgraded should only be True if updates were installed with a working
+    internet connection.
+
+    Returns the packages, and whether they should come from apt. From
+    apt, they are package names. Otherwise, they are files in /repo.
+    """
+    # Get packages for systemd-boot and systemd-boot-manager
+    index = local_repo.get_index("/repo")
+    packages = [each for each in index
+                if each[:12] == "systemd-boot" and index[each][0]["package"] == each]
+    packages.append("efibootmgr")
     if upgraded:
-        install_command = ["apt-get", "install", "-y", "--assume-yes"]
-        try:
-            apt_output = subproc.check_output(["apt-get", "update"])
-            apt_output = apt_output.decode()
-            if apt_output[:3].lower() == "ign":
-                # We lost internet. Revert to local archive
-                install_command = ["dpkg", "--install", "--force-confnew"]
-                upgraded = False
-        except subproc.CalledProcessError:
-            # We might have lost internet access. Fall back to local archive
-            install_command = ["dpkg", "--install", "--force-confnew"]
-            upgraded = False
-    else:
-        install_command = ["dpkg", "--install", "--force-confnew"]
+        return packages, True
+    # Updates WERE NOT installed, or there was no internet. Install these, and
+    # anything they need that isn't already installed, from the local repo.
+    installed = get_installed_versions()
+    packages = [each for each in packages
+                if each not in index or installed.get(each) != index[each][0]["version"]]
+    return local_repo.resolve(packages, index, installed), False
+
+
+def _install_systemd_boot(release, root, distro, compat_mode, upgraded,
+                          installed=False):
+    """set up and install systemd-boot"""
+    if not installed:
+        packages, from_apt = get_systemd_boot_packages(upgraded)
+        if from_apt:
+            subproc.check_call(["apt-get", "install", "-y", "--assume-yes"] + packages,
+                               stdout=stderr.buffer)
+        else:
+            batch = dpkg.Batch("/repo")
+            batch.install(packages)
+            batch.run()
 
     # This can be done at any point, but lets just go ahead and do it.
     try:
@@ -397,9 +426,9 @@ def _install_systemd_boot(release, root, distro, compat_mode, upgraded):
         subproc.check_call(["bootctl", "--path=/boot/efi", "install"],
                               stdout=stderr.buffer)
         # It is, we just ran installation. We're done here basically.
-    except subproc.CalledProcessError as e:
+    except (subproc.CalledProcessError, FileNotFoundError) as e:
         # Installation ran into an issue, but we have systemd-boot. Manually install it.
-        eprint("WARNING: bootctl issued CalledProcessError:")
+        eprint("WARNING: bootctl failed:")
         eprint(e)
         eprint("Performing manual installation of systemd-boot.")
         try:
@@ -424,49 +453,6 @@ def _install_systemd_boot(release, root, distro, compat_mode, upgraded):
                      "/boot/efi/EFI/systemd/systemd-bootx64.efi")
         except FileExistsError:
             pass
-    except FileNotFoundError:
-        # We do NOT have systemd-boot installed. Install it.
-        # using new installation method
-
-        # Get packages for systemd-boot
-        packages = [each for each in os.listdir("/repo") if "systemd-boot" in each]
-        os.chdir("/repo")
-        depends = subproc.check_output(["dpkg", "-f"] + packages + ["depends"])
-        depends = depends.decode()[:-1].split(", ")
-        depends = [depends[each[0]].split(" ")[0] for each in enumerate(depends)]
-        # Check if updates where installed
-        if not upgraded:
-            # Updates WERE NOT installed
-            for each in os.listdir():
-                for each1 in depends:
-                    if ((each1 in each) and (each not in packages)):
-                        packages.append(each)
-                        break
-
-            # Get packages for systemd-boot-manager
-            packages = [each for each in packages if "systemd-boot-manager" not in each]
-            new_packages = [each for each in os.listdir("/repo") if ("systemd-boot-manager" in each) or ("efibootmgr" in each)]
-            os.chdir("/repo")
-            depends = subproc.check_output(["dpkg", "-f"] + new_packages + ["depends"])
-            depends = depends.decode()[:-1].split(", ")
-            # List of dependencies
-            depends = [depends[each[0]].split(" ")[0] for each in enumerate(depends)]
-            # depends is just a list of package names. We now need to go through the list
-            # of files in this folder, and if the package name is in the file name, add
-            # it to the list `packages`
-            for each in os.listdir():
-                for each1 in depends:
-                    if ((each1 in each) and (each not in new_packages)):
-                        new_packages.append(each)
-                        break
-            packages = packages + new_packages
-        else:
-            # Updates WERE installed
-            packages = [each.split("_")[0] for each in packages]
-            packages.append("efibootmgr")
-    subproc.check_call(install_command + packages,
-                          stdout=stderr.buffer)
-    os.chdir("/")
     # This lib didn't exist before we installed this package.
     # So we can only now import it
     import systemd_boot_manager as sdbm
@@ -494,20 +480,36 @@ def _install_systemd_boot(release, root, distro, compat_mode, upgraded):
     check_systemd_boot(release, root, distro)
 
 
-def setup_lowlevel(efi, root, distro, compat_mode, upgraded=False):
+def setup_lowlevel(efi, root, distro, compat_mode, upgraded=False, workers=None):
     """Set up kernel and bootloader"""
     release = subproc.check_output(["uname", "--release"]).decode()[0:-1]
     eprint(f"Running kernel: { release }")
-    install_kernel(release)
+    progress_channel.stage("Installing kernel and bootloader")
+    # Install the kernel, and systemd-boot if it's coming from the local
+    # repo, in a single dpkg run
+    batch = dpkg.Batch("/repo")
+    install_kernel(release, batch)
+    systemd_boot = False
+    if efi not in ("NULL", None, "", False):
+        packages, from_apt = get_systemd_boot_packages(upgraded)
+        if not from_apt:
+            batch.install(packages)
+            systemd_boot = True
+    if batch.run():
+        autopurge()
     set_plymouth_theme()
     __update__(91)
+    # The bootloader needs every initramfs to be in place, so run
+    # anything held back so far
+    rebuild = dpkg.flush_triggers()
     eprint("\n    ###    MAKING INITRAMFS    ###    ")
-    if not os.path.exists("/var/tmp"):
-        os.mkdir("/var/tmp")
-        os.chmod("/var/tmp", 0o777)
-    subproc.check_call(["mkinitramfs", "-o", "/boot/initrd.img-" + release],
-                       stdout=stderr.buffer)
-    install_bootloader(efi, root, release, distro, compat_mode, upgraded)
+    # Always rebuild this one, to pick up the Plymouth theme
+    initramfs.build([release], workers, force=True)
+    if rebuild:
+        # Anything else only if it's out of date
+        initramfs.build(workers=workers)
+    install_bootloader(efi, root, release, distro, compat_mode, upgraded,
+                       systemd_boot)
     sleep(0.5)
     os.symlink("/boot/initrd.img-" + release, "/boot/initrd.img")
     os.symlink("/boot/vmlinuz-" + release, "/boot/vmlinuz")
@@ -639,13 +641,30 @@ def install(settings, distro):
     for each in range(len(processes_to_do) - 1, -1, -1):
         if processes_to_do[each][0] == "_":
             del processes_to_do[each]
-    MainInstallation(processes_to_do, settings)
-    handle_laptops(settings["USERNAME"])
-    setup_lowlevel(settings["EFI"], settings["ROOT"], distro,
-                   settings["COMPAT_MODE"], settings["UPDATES"])
-    verify(settings["USERNAME"], settings["ROOT"], distro)
-    if "PURGE" in settings:
-        purge_package(settings["PURGE"])
+    # Triggers (initramfs-tools, man-db, and so on) only run when
+    # setup_lowlevel() needs them to, and once more at the end
+    with dpkg.defer_triggers(settings.get("INITRAMFS_WORKERS")):
+        MainInstallation(processes_to_do, settings)
+        handle_laptops(settings["USERNAME"])
+        setup_lowlevel(settings["EFI"], settings["ROOT"], distro,
+                       settings["COMPAT_MODE"],
+                       settings["UPDATES"] and settings.get("INTERNET", False),
+                       settings.get("INITRAMFS_WORKERS"))
+        progress_channel.stage("Verifying installation")
+        session = transaction.Transaction()
+        verify(settings["USERNAME"], settings["ROOT"], distro, session,
+               settings.get("INITRAMFS_WORKERS"))
+        if "PURGE" in settings:
+            purge_package(settings["PURGE"], session)
+        if settings["USERNAME"] != "drauger-user":
+            session.autoremove()
+        session.commit()
+        session.report()
+    if ((settings["EFI"] not in ("NULL", None, "", False))
+            and (settings["USERNAME"] != "drauger-user")):
+        # Only copy the initramfs images to the ESP once they're final,
+        # after everything held back above has run
+        subproc.check_call(["update-systemd-boot"])
     # Mark a system as an OEM installation if necessary
     if "OEM" in settings.values():
         with open("/etc/edamame/oem-post-install.flag", "w") as file:
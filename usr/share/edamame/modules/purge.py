@@ -24,42 +24,32 @@
 """Make it easier to purge packages from the system"""
 import apt
 import os
+import modules.dpkg as dpkg
 
 
 def cache_commit(cache):
-    """Run apt.cache.commit(), with error handling"""
-    try:
-        cache.commit()
-    except apt.cache.LockFailedException:
-        try:
-            os.mkdir("/var/cache")
-        except FileExistsError:
-            pass
-        try:
-            os.mkdir("/var/cache/apt")
-        except FileExistsError:
-            pass
-        try:
-            os.mkdir("/var/cache/apt/archives")
-        except FileExistsError:
-            pass
-        with open("/var/cache/apt/archives/lock", "w+") as file:
-            file.write("")
-        os.chmod("/var/cache/apt/archives/lock", 0o640)
-        os.chown("/var/cache/apt/archives/lock", 0, 0)
+    """Run apt.cache.commit(), holding dpkg's frontend lock while it runs"""
+    os.makedirs("/var/cache/apt/archives/partial", exist_ok=True)
+    with dpkg.frontend_lock():
         cache.commit()
 
 
-def purge_package(pkg_name: list) -> None:
+def purge_package(pkg_name: list, session=None) -> None:
     """Purge packages from system using apt
 
     arguments: pkg_name
                 - Should be a list of package names to purge
                 - Can also remove a single package (provided as a string),
                     but this is less efficient
+               session
+                - Optional transaction.Transaction. If given, packages are
+                    only marked, and removed when that session is committed
     """
     if isinstance(pkg_name, str):
         pkg_name = [pkg_name]
+    if session is not None:
+        session.remove(pkg_name)
+        return
     cache = apt.cache.Cache()
     cache.open()
     with cache.actiongroup():
@@ -0,0 +1,119 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  scheduler.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Run installation tasks in parallel, in dependency order"""
+from __future__ import print_function
+from sys import stderr
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import time
+
+
+def eprint(*args, **kwargs):
+    """Make it easier for us to print to stderr"""
+    print(*args, file=stderr, **kwargs)
+
+
+def get_priorities(tasks):
+    """Work out the order tasks should be started in
+
+    A task's priority is its own weight plus the heaviest chain of tasks
+    waiting on it. So a cheap task that holds up a heavy one gets started
+    early, and heavy tasks get started before cheap ones.
+
+    Raises ValueError if the dependencies form a cycle.
+    """
+    priorities = {}
+    dependents = {each: [] for each in tasks}
+    for each in tasks:
+        for dep in tasks[each].get("depends", ()):
+            if dep in tasks:
+                dependents[dep].append(each)
+
+    def priority(name, chain):
+        if name in chain:
+            raise ValueError(f"Dependency cycle: {' -> '.join(chain + [name])}")
+        if name not in priorities:
+            downstream = [priority(each, chain + [name]) for each in dependents[name]]
+            priorities[name] = tasks[name].get("weight", 1) + max(downstream, default=0)
+        return priorities[name]
+
+    for each in tasks:
+        priority(each, [])
+    return priorities
+
+
+def run(tasks, workers=None, callback=None):
+    """Run `tasks' as separate processes
+
+    `tasks' should be a dictionary of task names, each set to a dictionary
+    containing:
+        target : function to run
+        args : list of arguments to pass to `target'
+        depends : names of tasks that must finish before this one starts
+        weight : rough cost of the task. Heavier tasks are started first.
+
+    Dependencies on tasks not in `tasks' are ignored.
+
+    At most `workers' tasks run at once. Defaults to the CPU count.
+
+    `callback' is called with the name of each task as it finishes.
+
+    Returns a dictionary of how long each task took, in seconds.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+        if workers is None:
+            workers = 1
+    priorities = get_priorities(tasks)
+    pending = sorted(tasks, key=lambda name: (-priorities[name], name))
+    done = set()
+    running = {}
+    timing = {}
+    while len(pending) > 0 or len(running) > 0:
+        # Start everything we can, in priority order
+        for name in list(pending):
+            if len(running) >= workers:
+                break
+            depends = [each for each in tasks[name].get("depends", ()) if each in tasks]
+            if not all(each in done for each in depends):
+                continue
+            process = multiprocessing.Process(target=tasks[name]["target"],
+                                              args=tasks[name].get("args", []))
+            process.start()
+            running[process.sentinel] = (name, process, time.monotonic())
+            pending.remove(name)
+            eprint(f"TASK STARTED: {name}")
+        # Block until at least one task finishes
+        for sentinel in wait(list(running)):
+            name, process, start = running.pop(sentinel)
+            process.join()
+            timing[name] = time.monotonic() - start
+            done.add(name)
+            if process.exitcode != 0:
+                eprint(f"WARNING: TASK {name} EXITED WITH CODE {process.exitcode}")
+            eprint(f"TASK FINISHED: {name} ({timing[name]:.2f} seconds)")
+            if callback is not None:
+                callback(name)
+    return timing
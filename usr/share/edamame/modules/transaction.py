@@ -0,0 +1,348 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  transaction.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Batch package changes into as few apt runs as possible
+
+Opening the apt cache takes several seconds on a full desktop image, and
+every commit is a separate dpkg run. A Transaction opens the cache once,
+collects every change asked of it, and applies them all in one commit.
+"""
+from __future__ import print_function
+from sys import stderr
+import contextlib
+import concurrent.futures as futures
+import hashlib
+import os
+import shutil
+import subprocess as subproc
+import threading
+import time
+import apt
+import urllib3
+
+import modules.purge as purge
+
+
+ARCHIVES = "/var/cache/apt/archives"
+# Where the installer mounts a local package cache directory
+CACHE_MOUNT = "/var/cache/edamame/packages"
+# How many packages to download at once
+PREFETCH_WORKERS = 4
+CHUNK = 1024 ** 2
+
+
+def __eprint__(*args, **kwargs):
+    """Make it easier for us to print to stderr"""
+    print(*args, file=stderr, **kwargs)
+
+
+def __archive_name__(version):
+    """Get the file name apt gives a downloaded package"""
+    return "_".join((version.package.shortname,
+                     version.version.replace(":", "%3a"),
+                     version.architecture)) + ".deb"
+
+
+def __check__(partial, dest, digest, sha256):
+    """Move a finished download into place if its checksum matches"""
+    if sha256 not in (None, "") and digest.hexdigest() != sha256:
+        os.remove(partial)
+        raise OSError("checksum mismatch")
+    os.replace(partial, dest)
+
+
+def __download__(http, uri, dest, sha256):
+    """Download `uri' to `dest', checking it against `sha256'
+
+    Returns the number of bytes downloaded.
+    """
+    partial = f"{ARCHIVES}/partial/{os.path.basename(dest)}"
+    digest = hashlib.sha256()
+    size = 0
+    with http.request("GET", uri, preload_content=False) as response:
+        if response.status != 200:
+            raise OSError(f"HTTP {response.status}")
+        with open(partial, "wb") as file:
+            for chunk in response.stream(CHUNK):
+                digest.update(chunk)
+                file.write(chunk)
+                size += len(chunk)
+    __check__(partial, dest, digest, sha256)
+    return size
+
+
+def __copy__(source, dest, sha256):
+    """Copy a package from a local directory to `dest'
+
+    Returns the number of bytes copied.
+    """
+    partial = f"{ARCHIVES}/partial/{os.path.basename(dest)}"
+    digest = hashlib.sha256()
+    size = 0
+    with open(source, "rb") as src, open(partial, "wb") as file:
+        while chunk := src.read(CHUNK):
+            digest.update(chunk)
+            file.write(chunk)
+            size += len(chunk)
+    __check__(partial, dest, digest, sha256)
+    return size
+
+
+class Transaction():
+    """A set of package changes, applied together by commit()
+
+    `package_cache' is an optional dictionary with the following values:
+        type : "directory" or "http"
+        location : path to a directory of .deb files, or the URL of a
+                   server with the same files at its top level
+
+    Packages are looked for there before going to the mirrors. A writable
+    directory cache also gets a copy of anything it didn't have.
+    """
+    def __init__(self, package_cache=None):
+        if package_cache in (None, {}) or package_cache.get("type") not in ("directory", "http"):
+            package_cache = None
+        self.package_cache = package_cache
+        self.cache_report = {"hit": 0, "miss": 0}
+        self.lock = threading.Lock()
+        self.cache = None
+        # What was asked for, so we can fall back to apt-get if commit() fails
+        self.requests = []
+        self.timing = {}
+        self.prefetched = set()
+        self.fetchers = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a block of work, adding it to self.timing under `name'"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timing[name] = self.timing.get(name, 0) + time.monotonic() - start
+
+    def open(self, update=False):
+        """Open the apt cache, updating package lists first if `update'"""
+        if self.cache is not None:
+            return self.cache
+        self.cache = apt.cache.Cache()
+        if update:
+            with self.phase("update"):
+                try:
+                    self.cache.update()
+                except apt.cache.FetchFailedException:
+                    subproc.check_call(["apt-get", "update"])
+        with self.phase("open"):
+            self.cache.open()
+        return self.cache
+
+    def upgrade(self):
+        """Mark every upgradable package for upgrade"""
+        with self.phase("upgrade"):
+            self.open().upgrade()
+        self.requests.append(("upgrade", []))
+
+    def install(self, packages):
+        """Mark a list of packages for installation"""
+        cache = self.open()
+        with self.phase("install"), cache.actiongroup():
+            for each in packages:
+                __eprint__(f"Installing `{each}'...")
+                cache[each].mark_install()
+        self.requests.append(("install", list(packages)))
+
+    def remove(self, packages):
+        """Mark a list of packages for removal, skipping any we don't have"""
+        if isinstance(packages, str):
+            packages = [packages]
+        cache = self.open()
+        with self.phase("remove"), cache.actiongroup():
+            for each in packages:
+                if each not in cache:
+                    continue
+                try:
+                    cache[each].mark_delete()
+                except SystemError:
+                    __eprint__(f"A problem occured trying to mark package `{each}' for removal. Skipping...")
+                    try:
+                        cache[each].mark_keep()
+                    except SystemError:
+                        __eprint__("Further errors occured! Ignoring...")
+        self.requests.append(("remove", list(packages)))
+
+    def autoremove(self):
+        """Mark everything nothing depends on anymore for removal
+
+        This accounts for every change already marked, so call it last.
+        """
+        cache = self.open()
+        with self.phase("autoremove"), cache.actiongroup():
+            for each in cache:
+                if each.is_auto_removable:
+                    each.mark_delete()
+        self.requests.append(("autoremove", []))
+
+    def __get_package__(self, http, uri, dest, sha256):
+        """Get a package from the package cache, or the mirror if it's not there
+
+        Returns the number of bytes fetched.
+        """
+        name = os.path.basename(dest)
+        if self.package_cache is not None:
+            location = self.package_cache["location"].rstrip("/")
+            try:
+                if self.package_cache["type"] == "directory":
+                    size = __copy__(f"{location}/{name}", dest, sha256)
+                else:
+                    size = __download__(http, f"{location}/{name}", dest, sha256)
+                with self.lock:
+                    self.cache_report["hit"] += 1
+                return size
+            except (OSError, urllib3.exceptions.HTTPError):
+                with self.lock:
+                    self.cache_report["miss"] += 1
+        size = __download__(http, uri, dest, sha256)
+        if ((self.package_cache is not None) and
+                (self.package_cache["type"] == "directory") and
+                os.access(self.package_cache["location"], os.W_OK)):
+            # Save the next machine a trip to the mirror
+            partial = f"{self.package_cache['location']}/.{name}.part"
+            try:
+                shutil.copyfile(dest, partial)
+                os.replace(partial, f"{self.package_cache['location']}/{name}")
+            except OSError:
+                __eprint__(f"Could not add {name} to the package cache")
+        return size
+
+    def __fetch_all__(self, jobs):
+        """Download every (uri, dest, sha256) in jobs, a few at a time"""
+        with self.phase("prefetch"):
+            http = urllib3.PoolManager(maxsize=PREFETCH_WORKERS, block=True)
+            total = 0
+            count = 0
+            with futures.ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as pool:
+                downloads = {pool.submit(self.__get_package__, http, *each): each
+                             for each in jobs}
+                for each in futures.as_completed(downloads):
+                    try:
+                        total += each.result()
+                        count += 1
+                    except (OSError, urllib3.exceptions.HTTPError) as error:
+                        # apt will try again when we commit
+                        __eprint__(f"Could not prefetch {downloads[each][0]}: {error}")
+        __eprint__(f"Prefetched {count} of {len(jobs)} packages ({total / (1024 ** 2):.1f} MiB)")
+
+    def prefetch(self, background=False):
+        """Download every package marked so far, ahead of commit()
+
+        apt downloads one package after another before unpacking anything.
+        This downloads them in parallel into apt's archive directory, so
+        commit() only has to unpack them. Packages already downloaded, or
+        not available over HTTP, are skipped.
+
+        If `background', return right away and keep downloading while
+        other work is done. commit() waits for it to finish.
+        """
+        cache = self.open()
+        jobs = []
+        for each in cache.get_changes():
+            if not (each.marked_install or each.marked_upgrade or
+                    each.marked_downgrade or each.marked_reinstall):
+                continue
+            version = each.candidate
+            dest = f"{ARCHIVES}/{__archive_name__(version)}"
+            if ((dest in self.prefetched) or os.path.exists(dest) or
+                    (version.uri is None) or (version.uri[:4] != "http")):
+                continue
+            jobs.append((version.uri, dest, version.sha256))
+            self.prefetched.add(dest)
+        if len(jobs) > 0:
+            os.makedirs(f"{ARCHIVES}/partial", exist_ok=True)
+            fetcher = threading.Thread(target=self.__fetch_all__,
+                                       args=(jobs,), daemon=True)
+            fetcher.start()
+            self.fetchers.append(fetcher)
+        if not background:
+            self.wait()
+
+    def wait(self):
+        """Wait for any background downloads to finish"""
+        for each in self.fetchers:
+            each.join()
+        self.fetchers = []
+
+    def __fallback__(self):
+        """Redo each request with apt-get, one at a time"""
+        commands = {"upgrade": ["apt-get", "-y", "upgrade"],
+                    "install": ["apt-get", "--force-yes", "-y", "install"],
+                    "remove": ["apt-get", "-y", "remove"],
+                    "autoremove": ["apt-get", "-y", "autoremove"]}
+        for action, packages in self.requests:
+            if action == "remove":
+                packages = [each for each in packages if each in self.cache]
+                if len(packages) == 0:
+                    continue
+            try:
+                subproc.check_call(commands[action] + packages,
+                                   stdout=stderr.buffer)
+            except subproc.CalledProcessError:
+                __eprint__("\t\t\t### WARNING ###")
+                __eprint__(f"{action.upper()} FAILED: {' '.join(packages)}")
+
+    def commit(self):
+        """Apply every marked change
+
+        If that fails, each request is retried on its own with apt-get, so
+        one broken package doesn't stop everything else.
+        """
+        if self.cache is None:
+            return
+        self.prefetch()
+        with self.phase("commit"):
+            if self.cache.get_changes():
+                try:
+                    purge.cache_commit(self.cache)
+                except (apt.cache.FetchFailedException,
+                        apt.cache.LockFailedException, apt.apt_pkg.Error,
+                        SystemError):
+                    __eprint__("Batched package changes failed. Retrying individually...")
+                    self.__fallback__()
+        self.requests = []
+        # Anything marked from here on needs a fresh view of the system
+        self.close()
+
+    def close(self):
+        """Close the apt cache"""
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def report(self):
+        """Log how long each phase took, and how well the package cache did"""
+        __eprint__("PACKAGE TIMING:")
+        for each in sorted(self.timing, key=self.timing.get, reverse=True):
+            __eprint__(f"\t{each}: {self.timing[each]:.2f} seconds")
+        if self.package_cache is not None:
+            __eprint__(f"PACKAGE CACHE ({self.package_cache['location']}): "
+                       f"{self.cache_report['hit']} hits, "
+                       f"{self.cache_report['miss']} misses")
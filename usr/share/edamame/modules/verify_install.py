@@ -27,11 +27,10 @@ from sys import stderr
 import os
 from shutil import move
 import subprocess as subproc
-import apt
 import auto_partitioner
-import common
 
-from modules import purge
+from modules import transaction
+from modules import initramfs
 
 
 def __eprint__(*args, **kwargs):
@@ -119,8 +118,16 @@ def is_default_entry(distro):
     return None
 
 
-def verify(username, root, distro):
-    """Verify installation success"""
+def verify(username, root, distro, session=None, workers=None):
+    """Verify installation success
+
+    If `session' is a transaction.Transaction, package removals are only
+    marked, and committed along with everything else in that session.
+    Otherwise, they are committed before returning.
+
+    `workers' is how many initramfs images may be built at once. See
+    initramfs.build().
+    """
     __eprint__("\t\t\t###    verify_install.py STARTED    ###    ")
     if os.path.isdir("/home/home/live"):
         move("/home/home/live", "/home/" + username)
@@ -138,34 +145,22 @@ def verify(username, root, distro):
             if status is None:
                 add_boot_entry(root, distro)
                 set_default_entry(distro)
-    cache = apt.cache.Cache()
-    cache.open()
+    own_session = session is None
+    if own_session:
+        session = transaction.Transaction()
+    cache = session.open()
     if username != "drauger-user":
         if "edamame" in cache:
             if cache["edamame"].is_installed:
-                cache["edamame"].mark_delete()
+                session.remove("edamame")
         if auto_partitioner.is_EFI():
-            with cache.actiongroup():
-                for each in cache:
-                    if (("grub" in each.name) and each.is_installed):
-                        if "common" not in each.name:
-                            try:
-                                each.mark_delete()
-                            except:
-                                __eprint__(f"A problem occured trying to remove package `{each.name}' for removal. Skipping...")
-                                try:
-                                    each.mark_keep()
-                                except:
-                                    # Insert shocked pikachu meme here
-                                    print("Further errors occured! Ignoring...")
-            versions = common.unique([each.split("-")[1] for each in os.listdir("/boot") if len(each.split("-")) > 1])
-            for release in versions:
-                __eprint__(f"Generating Initramfs for Kernel v{ release }")
-                subproc.check_call(["mkinitramfs", "-o",
-                                   f"/boot/initrd.img-{ release }",
-                                   release])
-            subproc.check_call(["update-systemd-boot"])
-        cache.commit()
-        purge.autoremove(cache)
-    cache.close()
+            session.remove([each.name for each in cache
+                            if (("grub" in each.name) and each.is_installed
+                                and ("common" not in each.name))])
+            initramfs.build(workers=workers)
+    if own_session:
+        if username != "drauger-user":
+            session.autoremove()
+        session.commit()
+        session.report()
     __eprint__("\t\t\t###    verify_install.py CLOSED    ###    ")
@@ -27,8 +27,8 @@ import sys
 import re
 import json
 import os
-import subprocess
 import auto_partitioner
+import block_devices
 import gi
 
 gi.require_version('Gtk', '3.0')
@@ -89,9 +89,7 @@ class Main(Gtk.Window):
         self.set_position(Gtk.WindowPosition.CENTER)
 
         # Get a list of disks and their capacity
-        self.devices = json.loads(subprocess.check_output(["lsblk", "-n", "-i", "--json",
-                                                           "-o", "NAME,SIZE,TYPE,FSTYPE"]).decode())
-        self.devices = self.devices["blockdevices"]
+        self.devices = block_devices.get_display_tree()
         dev = []
         for each2 in enumerate(self.devices):
             if "loop" in self.devices[each2[0]]["name"]:
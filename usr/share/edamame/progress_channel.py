@@ -0,0 +1,138 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  progress_channel.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Push installation progress to the progress window
+
+Messages are small JSON datagrams sent to an abstract Unix socket. Since
+abstract sockets don't live on the filesystem, the same address works
+from inside the installation chroot and from any forked worker process.
+
+Every message is a dictionary with two keys:
+    type : one of "percent", "stage" or "error"
+    value : an int for "percent", a string for everything else
+
+If no progress window is listening, messages are silently dropped. If
+the progress window is too far behind, most messages are dropped too, but
+the final 100% and errors are retried for up to TIMEOUT seconds, so the
+window still finds out how things ended.
+"""
+import errno
+import json
+import socket
+import time
+import common
+
+ADDRESS = "\0edamame-progress"
+TYPES = ("percent", "stage", "error")
+# How long to keep retrying messages that must get through, and how long
+# subscribe() waits for an old progress window to let go of ADDRESS,
+# in seconds
+TIMEOUT = 5
+
+__sender__ = {"socket": None}
+
+
+def send(msg_type, value):
+    """Send a message to the progress window, if one is listening"""
+    if msg_type not in TYPES:
+        raise ValueError(f"Unknown message type: {msg_type}")
+    if __sender__["socket"] is None:
+        __sender__["socket"] = socket.socket(socket.AF_UNIX,
+                                             socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+        __sender__["socket"].setblocking(False)
+    data = json.dumps({"type": msg_type, "value": value}).encode()
+    final = (msg_type == "error") or (msg_type == "percent" and value >= 100)
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        try:
+            __sender__["socket"].sendto(data, ADDRESS)
+            return
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Nobody listening
+            return
+        except BlockingIOError:
+            # They're too far behind. Only wait for them if this is how
+            # the installation ended.
+            if (not final) or (time.monotonic() >= deadline):
+                return
+            time.sleep(0.05)
+
+
+def percent(value):
+    """Report overall installation progress, as a percentage"""
+    send("percent", int(value))
+
+
+def stage(name):
+    """Report the installation step now running"""
+    send("stage", str(name))
+
+
+def error(message):
+    """Report an error"""
+    send("error", str(message))
+
+
+def subscribe():
+    """Start listening for progress messages
+
+    Returns a non-blocking socket. Pass it to receive() whenever it becomes
+    readable.
+
+    If another progress window still holds ADDRESS after TIMEOUT seconds,
+    returns None instead, and progress messages go to that window.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        try:
+            sock.bind(ADDRESS)
+            break
+        except OSError as error:
+            if error.errno != errno.EADDRINUSE:
+                sock.close()
+                raise
+            # An old progress window may still be shutting down
+            if time.monotonic() >= deadline:
+                common.eprint("Another progress window is still listening. Not showing progress.")
+                sock.close()
+                return None
+            time.sleep(0.1)
+    sock.setblocking(False)
+    return sock
+
+
+def receive(sock):
+    """Get all messages waiting on `sock', oldest first"""
+    messages = []
+    while True:
+        try:
+            data = sock.recv(65536)
+        except BlockingIOError:
+            return messages
+        try:
+            message = json.loads(data)
+        except json.decoder.JSONDecodeError:
+            continue
+        if isinstance(message, dict) and message.get("type") in TYPES:
+            messages.append(message)
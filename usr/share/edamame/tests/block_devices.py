@@ -0,0 +1 @@
+../block_devices.py
\ No newline at end of file
@@ -0,0 +1 @@
+../check_internet.py
\ No newline at end of file
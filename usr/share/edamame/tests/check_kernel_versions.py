@@ -0,0 +1 @@
+../check_kernel_versions.py
\ No newline at end of file
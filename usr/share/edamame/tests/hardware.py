@@ -0,0 +1 @@
+../hardware.py
\ No newline at end of file
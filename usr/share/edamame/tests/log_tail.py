@@ -0,0 +1 @@
+../log_tail.py
\ No newline at end of file
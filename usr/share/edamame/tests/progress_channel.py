@@ -0,0 +1 @@
+../progress_channel.py
\ No newline at end of file
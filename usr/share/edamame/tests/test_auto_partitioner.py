@@ -158,3 +158,37 @@ def test_get_drive_path():
         for each1 in ide_list[each]:
             assert each == ap.get_drive_path(each1)
         assert each == ap.get_drive_path(each)
+
+
+def test_plan_layout():
+    """Make sure planned partitions are aligned, in order, and fill the drive"""
+    efi = ap.is_EFI()
+    # 500 GB drive, with 512 byte sectors, and GPT's usual free space
+    length = ap.gb_to_bytes(500) // 512
+    layout = ap.plan_layout(length, 512, [(34, length - 34)], efi, "MAKE")
+    names = [each["name"] for each in layout]
+    if efi:
+        assert names == ["EFI", "ROOT", "HOME"]
+    else:
+        assert names == ["ROOT", "HOME"]
+    for each in range(len(layout)):
+        assert layout[each]["start"] % 2048 == 0
+        assert layout[each]["end"] > layout[each]["start"]
+        if each > 0:
+            assert layout[each]["start"] == layout[each - 1]["end"] + 1
+    assert layout[-1]["end"] == length - 34
+    assert [each["boot"] for each in layout].count(True) == 1
+
+
+def test_plan_layout_small_drive():
+    """Small drives shouldn't get a home partition"""
+    length = ap.gb_to_bytes(16) // 512
+    layout = ap.plan_layout(length, 512, [(34, length - 34)], ap.is_EFI(),
+                            "MAKE")
+    assert "HOME" not in [each["name"] for each in layout]
+    try:
+        ap.plan_layout(length, 512, [(34, 1000)], ap.is_EFI(), None)
+    except ValueError:
+        pass
+    else:
+        assert False
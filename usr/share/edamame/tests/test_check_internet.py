@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_check_internet.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Tests for check_internet"""
+import json
+import tempfile
+import threading
+import time
+import check_internet
+
+
+def __with_servers__(servers, ping, test):
+    """Run test with `servers' in settings.json, answered by `ping'"""
+    settings = check_internet.SETTINGS
+    real_ping = check_internet.ping
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as file:
+        json.dump({"ping servers": servers}, file)
+        file.flush()
+        check_internet.SETTINGS = file.name
+        check_internet.ping = ping
+        try:
+            test()
+        finally:
+            check_internet.SETTINGS = settings
+            check_internet.ping = real_ping
+
+
+def test_majority_and_cache():
+    """Make sure we stop once most servers agree, and reuse the result"""
+    servers = ["a.example", "b.example", "c.example", "d.example", "e.example"]
+    stuck = threading.Event()
+    calls = []
+
+    def ping(mirror):
+        calls.append(mirror)
+        if mirror in ("d.example", "e.example"):
+            # Never answers in time
+            stuck.wait(check_internet.DEADLINE * 2)
+        return True
+
+    def test():
+        start = time.monotonic()
+        assert check_internet.has_internet(refresh=True)
+        assert time.monotonic() - start < check_internet.DEADLINE
+        count = len(calls)
+        assert check_internet.has_internet()
+        assert len(calls) == count
+
+    try:
+        __with_servers__(servers, ping, test)
+    finally:
+        stuck.set()
+
+
+def test_no_servers():
+    """Make sure having no servers to ping means no internet"""
+    def test():
+        assert not check_internet.has_internet(refresh=True)
+
+    __with_servers__([], lambda mirror: True, test)
@@ -0,0 +1,94 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  test_hardware.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Test hardware Library"""
+import os
+import shutil
+import hardware
+
+
+SYS = "hardware-test-sys"
+IDS = "hardware-test-pci.ids"
+
+DEVICES = {"0000:00:02.0": ("0x8086", "0x3e92", "0x030000", "0x02"),
+           "0000:01:00.0": ("0x10de", "0x2484", "0x030000", "0xa1"),
+           "0000:01:00.1": ("0x10de", "0x228b", "0x040300", "0xa1"),
+           "0000:02:00.0": ("0x10ec", "0x8168", "0x020000", "0x15")}
+
+PCI_IDS = """# Test database
+8086  Intel Corporation
+\t3e92  CoffeeLake-S GT2 [UHD Graphics 630]
+10de  NVIDIA Corporation
+\t228b  GA104 High Definition Audio Controller
+\t2484  GA104 [GeForce RTX 3070]
+\t\t1043 87b8  TUF Gaming GeForce RTX 3070
+10ec  Realtek Semiconductor Co., Ltd.
+\t8168  RTL8111/8168/8411 PCI Express Gigabit Ethernet Controller
+C 02  Network controller
+\t00  Ethernet controller
+C 03  Display controller
+\t00  VGA compatible controller
+\t\t00  VGA controller
+C 04  Multimedia controller
+\t03  Audio device
+"""
+
+
+def setup_module():
+    """Build a fake sysfs tree and pci.ids database"""
+    for slot, values in DEVICES.items():
+        os.makedirs(f"{SYS}/{slot}")
+        for name, value in zip(("vendor", "device", "class", "revision"), values):
+            with open(f"{SYS}/{slot}/{name}", "w") as file:
+                file.write(value + "\n")
+    with open(IDS, "w") as file:
+        file.write(PCI_IDS)
+    hardware.SYS_PCI = SYS
+    hardware.PCI_IDS = (IDS,)
+    hardware.refresh()
+
+
+def teardown_module():
+    """Clean up the fake sysfs tree and pci.ids database"""
+    shutil.rmtree(SYS)
+    os.remove(IDS)
+
+
+def test_get_devices():
+    """Make sure devices can be found by vendor and class"""
+    assert len(hardware.get_devices()) == 4
+    nvidia = hardware.get_devices(vendor=hardware.NVIDIA)
+    assert [each["device"] for each in nvidia] == [0x2484, 0x228b]
+    display = hardware.get_devices(vendor=hardware.NVIDIA,
+                                   base_class=hardware.DISPLAY)
+    assert len(display) == 1
+    assert display[0]["device_name"] == "GA104 [GeForce RTX 3070]"
+    network = hardware.get_devices(base_class=hardware.NETWORK)
+    assert network[0]["vendor_name"] == "Realtek Semiconductor Co., Ltd."
+
+
+def test_report():
+    """Make sure the report looks like `lspci -nn'"""
+    report = hardware.get_report()
+    assert report[1] == "01:00.0 VGA compatible controller [0300]: NVIDIA Corporation GA104 [GeForce RTX 3070] [10de:2484] (rev a1)"
+    assert report[2].startswith("01:00.1 Audio device [0403]: ")
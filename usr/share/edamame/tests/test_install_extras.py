@@ -22,6 +22,7 @@
 #
 #
 """Test install_extras Library"""
+import tempfile
 from modules import install_extras as ie
 
 
@@ -60,3 +61,47 @@ def test_determine_driver():
             assert (not each[1])
         else:
             assert each[1]
+
+
+def test_is_supported_index():
+    """Make sure drivers covered by the index never get downloaded"""
+    index = {"drivers": [550, 535],
+             "devices": {"2484": [550, 535], "1e89": [535]}}
+    assert ie.is_supported(550, ("2484", "Nvidia GeForce RTX 3070"), index)
+    assert ie.is_supported(535, ("1E89", "Nvidia GeForce RTX 2060"), index)
+    assert not ie.is_supported(550, ("1E89", "Nvidia GeForce RTX 2060"), index)
+    assert not ie.is_supported(550, ("0041", "Nvidia GeForce 6800"), index)
+
+
+def test_is_supported_probe_cache():
+    """Make sure saved probe results are used instead of downloading drivers"""
+    cache = ie.PROBE_CACHE
+    with tempfile.TemporaryDirectory() as folder:
+        ie.PROBE_CACHE = f"{folder}/nvidia-probes.json"
+        try:
+            ie.__save_probe__(390, "1e89", True)
+            ie.__save_probe__(390, "0041", False)
+            index = {"drivers": [], "devices": {}}
+            assert ie.is_supported(390, ("1E89", "Nvidia GeForce RTX 2060"), index)
+            assert not ie.is_supported(390, ("0041", "Nvidia GeForce 6800"), index)
+        finally:
+            ie.PROBE_CACHE = cache
+
+
+def test_is_supported_offline():
+    """Make sure failed probes aren't saved when we're offline"""
+    cache = ie.PROBE_CACHE
+    check_compat = ie.check_compat
+    with tempfile.TemporaryDirectory() as folder:
+        ie.PROBE_CACHE = f"{folder}/nvidia-probes.json"
+        ie.check_compat = lambda version_number, card: False
+        try:
+            index = {"drivers": [], "devices": {}}
+            card = ("1E89", "Nvidia GeForce RTX 2060")
+            assert not ie.is_supported(390, card, index, internet=False)
+            assert ie.__read_probes__() == {}
+            assert not ie.is_supported(390, card, index, internet=True)
+            assert ie.__read_probes__() == {"390": {"1e89": False}}
+        finally:
+            ie.PROBE_CACHE = cache
+            ie.check_compat = check_compat
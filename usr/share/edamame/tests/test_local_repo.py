@@ -0,0 +1,65 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  test_local_repo.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Test local_repo Library"""
+from modules import local_repo
+
+
+def package(name, version, depends=(), provides=()):
+    """Make an index entry like local_repo.read_control() would"""
+    return {"file": f"{name}_{version}_amd64.deb", "package": name,
+            "version": version, "depends": [list(each) for each in depends],
+            "provides": list(provides)}
+
+
+INDEX = {}
+for each in (package("systemd-boot", "255.4-1",
+                     [[("libc6", "2.38", ">=")],
+                      [("systemd-boot-efi", "255.4-1", "=")]]),
+             package("systemd-boot-efi", "255.4-1"),
+             package("libc6", "2.39-0ubuntu8"),
+             package("libc6-dev", "2.39-0ubuntu8"),
+             package("efibootmgr", "18-1",
+                     [[("libefiboot1t64", "", ""), ("libefiboot1", "", "")],
+                      [("libc6", "2.34", ">=")]]),
+             package("libefiboot1t64", "38-3.1", provides=[("libefiboot1", "", "")])):
+    INDEX.setdefault(each["package"], []).append(each)
+
+
+def test_resolve_minimal():
+    """Make sure satisfied dependencies aren't pulled from the repo"""
+    installed = {"libc6": "2.39-0ubuntu8", "libefiboot1t64": "38-3.1"}
+    result = local_repo.resolve(["systemd-boot", "efibootmgr"], INDEX, installed)
+    assert result == ["systemd-boot-efi_255.4-1_amd64.deb",
+                      "systemd-boot_255.4-1_amd64.deb",
+                      "efibootmgr_18-1_amd64.deb"]
+
+
+def test_resolve_versions():
+    """Make sure too old installed packages get replaced, without similarly named ones"""
+    installed = {"libc6": "2.35-0ubuntu3"}
+    result = local_repo.resolve(["systemd-boot", "efibootmgr"], INDEX, installed)
+    assert "libc6_2.39-0ubuntu8_amd64.deb" in result
+    assert "libc6-dev_2.39-0ubuntu8_amd64.deb" not in result
+    assert "libefiboot1t64_38-3.1_amd64.deb" in result
+    assert result.index("libc6_2.39-0ubuntu8_amd64.deb") < result.index("systemd-boot_255.4-1_amd64.deb")
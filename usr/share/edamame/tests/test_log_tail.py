@@ -0,0 +1,77 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  test_log_tail.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Test log_tail Library"""
+import os
+import log_tail
+
+
+LOG = "log-tail-test.log"
+
+
+def write(text, mode="a"):
+    """Write `text' to the test log"""
+    with open(LOG, mode) as file:
+        file.write(text)
+
+
+def test_read_only_new_lines():
+    """Make sure only the last lines are kept, and only new data triggers a change"""
+    write("".join(f"line {each}\n" for each in range(20)), mode="w")
+    tail = log_tail.LogTail(LOG, lines=5)
+    try:
+        assert tail.read() is True
+        assert tail.get_lines() == [f"line {each}" for each in range(15, 20)]
+        assert tail.read() is False
+        write("line 20\n")
+        assert tail.read() is True
+        assert tail.get_lines() == [f"line {each}" for each in range(16, 21)]
+    finally:
+        os.remove(LOG)
+
+
+def test_partial_line():
+    """Make sure an unfinished line is shown and completed later"""
+    write("first\nsec", mode="w")
+    tail = log_tail.LogTail(LOG, lines=5)
+    try:
+        tail.read()
+        assert tail.get_lines() == ["first", "sec"]
+        write("ond\n")
+        tail.read()
+        assert tail.get_lines() == ["first", "second"]
+    finally:
+        os.remove(LOG)
+
+
+def test_truncated():
+    """Make sure a truncated log is read from the beginning again"""
+    write("old\nlines\n", mode="w")
+    tail = log_tail.LogTail(LOG, lines=5)
+    try:
+        tail.read()
+        write("new\n", mode="w")
+        assert tail.read() is True
+        assert tail.get_lines() == ["new"]
+    finally:
+        os.remove(LOG)
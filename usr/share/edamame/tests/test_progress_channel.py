@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_progress_channel.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Tests for progress_channel"""
+import threading
+import time
+import progress_channel
+
+
+def test_round_trip():
+    """Make sure messages arrive in order, with their types intact"""
+    sock = progress_channel.subscribe()
+    try:
+        progress_channel.stage("Partitioning")
+        progress_channel.percent(12.6)
+        progress_channel.error("Something broke")
+        assert progress_channel.receive(sock) == [
+            {"type": "stage", "value": "Partitioning"},
+            {"type": "percent", "value": 12},
+            {"type": "error", "value": "Something broke"}]
+        assert progress_channel.receive(sock) == []
+    finally:
+        sock.close()
+
+
+def test_unknown_type():
+    """Make sure unknown message types are refused"""
+    try:
+        progress_channel.send("log", "Finished: apt")
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_final_message_waits():
+    """Make sure the final 100% gets through even when the window is behind"""
+    sock = progress_channel.subscribe()
+    try:
+        # Fill the window's queue until messages start being dropped
+        while True:
+            try:
+                progress_channel.__sender__["socket"].sendto(b"{}", progress_channel.ADDRESS)
+            except BlockingIOError:
+                break
+        progress_channel.percent(50)
+        # Make room for a few messages, like a window catching up would
+        drain = threading.Timer(0.5, lambda: [sock.recv(65536) for each in range(10)])
+        drain.start()
+        progress_channel.percent(100)
+        drain.join()
+        assert progress_channel.receive(sock) == [{"type": "percent", "value": 100}]
+    finally:
+        sock.close()
+
+
+def test_subscribe_in_use():
+    """Make sure a second window gives up instead of crashing"""
+    timeout = progress_channel.TIMEOUT
+    progress_channel.TIMEOUT = 0.3
+    sock = progress_channel.subscribe()
+    try:
+        start = time.monotonic()
+        assert progress_channel.subscribe() is None
+        assert time.monotonic() - start >= 0.3
+    finally:
+        sock.close()
+        progress_channel.TIMEOUT = timeout
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  test_scheduler.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Test scheduler Library"""
+import os
+import time
+import pytest
+from modules import scheduler
+
+
+LOG = "scheduler-test.log"
+
+
+def log_name(name):
+    """Append `name' to the test log"""
+    time.sleep(0.05)
+    with open(LOG, "a") as file:
+        file.write(name + "\n")
+
+
+def test_get_priorities():
+    """Make sure cheap tasks blocking heavy ones get priority"""
+    tasks = {"heavy": {"depends": ["cheap"], "weight": 10},
+             "cheap": {"weight": 1},
+             "other": {"weight": 2}}
+    priorities = scheduler.get_priorities(tasks)
+    assert priorities["cheap"] == 11
+    assert priorities["heavy"] == 10
+    assert priorities["other"] == 2
+
+
+def test_get_priorities_cycle():
+    """Make sure dependency cycles are caught"""
+    tasks = {"a": {"depends": ["b"]}, "b": {"depends": ["a"]}}
+    with pytest.raises(ValueError):
+        scheduler.get_priorities(tasks)
+
+
+def test_run_order():
+    """Make sure tasks never start before their dependencies finish"""
+    if os.path.exists(LOG):
+        os.remove(LOG)
+    tasks = {"c": {"target": log_name, "args": ["c"], "depends": ["b"]},
+             "b": {"target": log_name, "args": ["b"], "depends": ["a"]},
+             "a": {"target": log_name, "args": ["a"]},
+             "d": {"target": log_name, "args": ["d"], "depends": ["missing"]}}
+    finished = []
+    timing = scheduler.run(tasks, workers=4, callback=finished.append)
+    with open(LOG, "r") as file:
+        order = file.read().split()
+    os.remove(LOG)
+    assert order.index("a") < order.index("b") < order.index("c")
+    assert sorted(finished) == ["a", "b", "c", "d"]
+    assert sorted(timing) == ["a", "b", "c", "d"]
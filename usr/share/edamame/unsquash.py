@@ -0,0 +1,143 @@
+#!shebang
+# -*- coding: utf-8 -*-
+#
+#  unsquash.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Extract the root filesystem squashfs onto the installation drive"""
+import os
+import pty
+import re
+import struct
+import fcntl
+import termios
+import time
+import subprocess
+import psutil
+import common
+
+
+PROGRESS = re.compile(rb"(\d+)/(\d+)\s+(\d+)%")
+CREATED = re.compile(rb"created (\d+) (\w+)")
+
+
+def read_superblock(squashfs):
+    """Read the parts of the squashfs superblock we care about
+
+    Returns a dictionary with the inode count, block size and the number
+    of bytes used by the filesystem image.
+    """
+    with open(squashfs, "rb") as file:
+        data = file.read(48)
+    magic, inodes, _, block_size = struct.unpack_from("<IIII", data, 0)
+    if magic != 0x73717368:
+        raise ValueError(f"{squashfs} is not a squashfs image")
+    bytes_used = struct.unpack_from("<Q", data, 40)[0]
+    return {"inodes": inodes, "block_size": block_size,
+            "bytes_used": bytes_used}
+
+
+def get_tuning():
+    """Get processor count and queue sizes for unsquashfs
+
+    Every processor gets a decompression thread. The data and fragment
+    queues each get an eighth of available RAM, between 64 and 1024 MB, so
+    low-RAM machines don't swap and large ones aren't held back by the
+    256 MB default.
+    """
+    processors = os.cpu_count()
+    if processors is None:
+        processors = 1
+    available = psutil.virtual_memory().available // (1024 ** 2)
+    queue = min(max(available // 8, 64), 1024)
+    return {"processors": processors, "data_queue": queue,
+            "frag_queue": queue}
+
+
+def extract(squashfs, target, flags=None, callback=None):
+    """Extract `squashfs' directly into `target'
+
+    `flags' is a list of any extra flags to pass to unsquashfs.
+
+    `callback' is called with the percentage complete (0-100) each time
+    that number changes.
+
+    Returns a dictionary of statistics about the extraction.
+    """
+    if flags is None:
+        flags = []
+    superblock = read_superblock(squashfs)
+    tuning = get_tuning()
+    cmd = ["unsquashfs", "-f", "-d", target,
+           "-processors", str(tuning["processors"]),
+           "-da", str(tuning["data_queue"]),
+           "-fr", str(tuning["frag_queue"])] + flags + [squashfs]
+    common.eprint(f"Extracting with {tuning['processors']} processors, {tuning['data_queue']} MB queues")
+    # unsquashfs only draws its progress bar on a terminal, so give it one
+    parent, child = pty.openpty()
+    fcntl.ioctl(child, termios.TIOCSWINSZ, struct.pack("HHHH", 24, 80, 0, 0))
+    start = time.monotonic()
+    process = subprocess.Popen(cmd, stdout=child, stderr=child)
+    os.close(child)
+    buffer = b""
+    output = []
+    percent = -1
+    written = 0
+    while True:
+        try:
+            chunk = os.read(parent, 4096)
+        except OSError:
+            # EIO: unsquashfs closed the terminal
+            break
+        if chunk == b"":
+            break
+        buffer += chunk
+        lines = re.split(rb"[\r\n]", buffer)
+        buffer = lines.pop()
+        for each in lines:
+            match = PROGRESS.search(each)
+            if match is None:
+                if each.strip() != b"":
+                    output.append(each)
+                continue
+            written = int(match.group(1))
+            if int(match.group(3)) != percent:
+                percent = int(match.group(3))
+                if callback is not None:
+                    callback(percent)
+    os.close(parent)
+    process.wait()
+    elapsed = time.monotonic() - start
+    if buffer.strip() != b"":
+        output.append(buffer)
+    output = b"\n".join(output)
+    if process.returncode != 0:
+        common.eprint(output.decode(errors="replace"))
+        raise subprocess.CalledProcessError(process.returncode, cmd,
+                                            output=output)
+    stats = {"inodes": superblock["inodes"], "seconds": elapsed,
+             "bytes": written * superblock["block_size"], "created": {}}
+    for each in CREATED.finditer(output):
+        stats["created"][each.group(2).decode()] = int(each.group(1))
+    size = stats["bytes"] / (1024 ** 2)
+    common.eprint(f"EXTRACTED {size:.0f} MiB IN {elapsed:.1f} SECONDS ({size / max(elapsed, 0.001):.1f} MiB/s)")
+    for each in stats["created"]:
+        common.eprint(f"created {stats['created'][each]} {each}")
+    return stats